@@ -1,6 +1,12 @@
+import itertools
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
 import pandas as pd
+import numpy as np
+import openpyxl
 import streamlit as st
 
 st.set_page_config(page_title="TakeOut Restaurant Management System", layout="wide")
@@ -9,7 +15,8 @@ st.set_page_config(page_title="TakeOut Restaurant Management System", layout="wi
 from modules import auth
 from modules import db
 from modules import invoice as inv
-from modules.utils import compute_profit_metrics, compute_vat, peso, ymd
+from modules.metrics import profit_metrics
+from modules.utils import compute_profit_metrics, compute_profit_metrics_vec, compute_vat, peso, ymd
 
 # -------------------- Config & Secrets --------------------
 DB_FILE = os.environ.get("TAKEOUT_DB_PATH", "takeout.db")
@@ -26,9 +33,34 @@ def has_drive_secrets() -> bool:
     except Exception:
         return False
 
+# Schema + admin check once per process; cleared whenever the DB file is
+# swapped out (Drive download, restore) so the new file gets checked too.
+@st.cache_resource
+def _bootstrap():
+    db.init_db()
+    return True
+
+# Big, unpaginated listings live here instead of st.cache_data so a cache hit
+# hands back the frame itself (no pickle round-trip). Entries are
+# {name: (version, df)}; callers must .copy() before mutating.
+@st.cache_resource
+def _frame_cache():
+    return {}
+
+def clear_caches():
+    """Drop every cached query result after a write or a DB file swap."""
+    st.cache_data.clear()
+    _frame_cache().clear()
+
 # -------------------- (Optional) Google Drive Sync FIRST --------------------
-# Do this BEFORE any DB connections or init to avoid Windows file lock issues.
-if has_drive_secrets():
+# Do this BEFORE init so a fresh process holds no handle on the DB (Windows
+# file locks): db.checkpoint() uses a short-lived connection when the shared
+# one isn't open yet, and newest_wins_sync closes the app's connections
+# (db.swapping) before it swaps the file for later sessions.
+# Once per session, not on every rerun: each sync checkpoints and hashes the
+# whole DB file. The sidebar keeps showing the outcome afterwards.
+def startup_sync():
+    """Returns (drive_ready, sidebar method, message)."""
     from modules import gdrive
     from modules import sync
 
@@ -38,28 +70,32 @@ if has_drive_secrets():
         ok, info = False, f"Probe failed: {e}"
 
     if not ok:
-        st.sidebar.warning(f"Drive folder not accessible: {info}")
-        drive_ready = False
-    else:
-        try:
-            res = sync.newest_wins_sync(DB_FILE, st.secrets["gdrive"]["folder_id"])
-            drive_ready = True
-            msg = res.get("action", "noop")
-            if msg == "download":
-                st.sidebar.success("DB updated from Drive (remote newer).")
-            elif msg == "upload":
-                st.sidebar.info("DB pushed to Drive (local newer).")
-            else:
-                st.sidebar.caption("DB in sync with Drive.")
-        except Exception as e:
-            drive_ready = False
-            st.sidebar.warning(f"Drive sync skipped (error): {e}")
+        return False, "warning", f"Drive folder not accessible: {info}"
+    try:
+        db.checkpoint()  # flush WAL so the size/mtime compare sees every commit
+        res = sync.newest_wins_sync(DB_FILE, st.secrets["gdrive"]["folder_id"])
+    except Exception as e:
+        return False, "warning", f"Drive sync skipped (error): {e}"
+    msg = res.get("action", "noop")
+    if msg == "download":
+        clear_caches()
+        _bootstrap.clear()
+        return True, "success", "DB updated from Drive (remote newer)."
+    elif msg == "upload":
+        return True, "info", "DB pushed to Drive (local newer)."
+    return True, "caption", "DB in sync with Drive."
+
+if has_drive_secrets():
+    if "startup_sync" not in st.session_state:
+        st.session_state["startup_sync"] = startup_sync()
+    drive_ready, level, text = st.session_state["startup_sync"]
+    getattr(st.sidebar, level)(text)
 else:
     st.sidebar.caption("Drive sync disabled (no secrets).")
     drive_ready = False
 
 # -------------------- DB Init AFTER sync --------------------
-db.init_db()
+_bootstrap()
 
 # -------------------- Auth helpers --------------------
 ROLE_LEVEL = auth.ROLE_LEVEL
@@ -95,6 +131,12 @@ REQUIRES = {
     "Admin / Users": "admin",
     "Settings / Import": "user",
 }
+# Viewer-level pages stay visible when logged out.
+PUBLIC_PAGES = frozenset({"Dashboard", "Sales Reports", "Expense Reports", "Financial Statements", "Profile"})
+ALLOWED_BY_ROLE = {
+    role: sorted(p for p in PAGES if level >= ROLE_LEVEL[REQUIRES[p]] or p in PUBLIC_PAGES)
+    for role, level in ROLE_LEVEL.items()
+}
 
 def current_user():
     return st.session_state.get("auth_user")
@@ -104,7 +146,7 @@ def require_role(page: str):
     need = REQUIRES.get(page, "viewer")
     if u is None:
         return False, f"Login required: {page} needs role **{need}**."
-    if ROLE_LEVEL[u["role"]] < ROLE_LEVEL[need]:
+    if ROLE_LEVEL.get(u["role"], 0) < ROLE_LEVEL[need]:
         return False, f"Access denied: {page} needs role **{need}**, you are **{u['role']}**."
     if not u.get("is_active", True):
         return False, "Your account is inactive. Contact admin."
@@ -119,6 +161,8 @@ def login_block():
     if submitted:
         row = auth.get_user(username)
         if row and auth.verify_password(password, row["pw_hash"], row["pw_salt"]) and row["is_active"] == 1:
+            if auth.needs_rehash(row["pw_hash"]):
+                auth.upgrade_password(row["username"], password)
             st.session_state["auth_user"] = {
                 "username": row["username"],
                 "role": row["role"],
@@ -148,12 +192,376 @@ def login_block():
             except Exception as e:
                 st.error(f"Registration failed: {e}")
 
-def product_options():
-    with db.get_conn() as conn:
-        rows = conn.execute(
-            "SELECT id, name, item_code FROM products WHERE status!='Archived' OR status IS NULL ORDER BY name"
-        ).fetchall()
-        return {f"{r['name']} ({r['item_code'] or '—'})": r["id"] for r in rows}
+def product_map():
+    """Active products indexed by their selectbox label; rebuilt after clear_caches()."""
+    cache = _frame_cache()
+    hit = cache.get("product_map")
+    if hit is None:
+        df = pd.read_sql_query(
+            "SELECT id, name, item_code, selling_price FROM products WHERE status!='Archived' OR status IS NULL ORDER BY name",
+            db.get_conn(),
+        )
+        df["label"] = df["name"].astype(str) + " (" + df["item_code"].fillna("—").replace("", "—").astype(str) + ")"
+        df["selling_price"] = df["selling_price"].fillna(0.0)
+        df = df.drop_duplicates("label", keep="last").set_index("label")
+        hit = cache["product_map"] = (None, df)
+    return hit[1]
+
+# -------------------- Cached dashboard queries --------------------
+# Keyed by the current day so the cache rolls over at midnight; writes call
+# clear_caches() so new rows show up on the next run.
+@st.cache_data(ttl=60)
+def dashboard_totals(day: str):
+    conn = db.get_conn()
+    row = conn.execute(
+        """
+        SELECT (SELECT COUNT(*) FROM products) AS products,
+               (SELECT SUM(current_inventory_value) FROM inventory) AS inventory_value,
+               (SELECT SUM(total_amount) FROM sales) AS sales_all_time,
+               (SELECT SUM(total_cost) FROM expenses) AS expenses_all_time
+        """
+    ).fetchone()
+    return {
+        "products": row["products"],
+        "inventory_value": row["inventory_value"] or 0.0,
+        "sales_all_time": row["sales_all_time"] or 0.0,
+        "expenses_all_time": row["expenses_all_time"] or 0.0,
+    }
+
+@st.cache_data(ttl=60)
+def daily_trends_30(day: str):
+    """Last 30 days with sales and with expenses, in one round-trip."""
+    df = pd.read_sql_query(
+        """
+        WITH s AS (
+            SELECT 'sales' AS k, substr(billing_date,1,10) AS d, SUM(total_amount) AS v
+              FROM sales
+             GROUP BY 2
+             ORDER BY 2 DESC
+             LIMIT 30
+        ), e AS (
+            SELECT 'expenses' AS k, substr(purchase_date,1,10) AS d, SUM(total_cost) AS v
+              FROM expenses
+             GROUP BY 2
+             ORDER BY 2 DESC
+             LIMIT 30
+        )
+        SELECT * FROM s UNION ALL SELECT * FROM e
+        """,
+        db.get_conn(),
+    )
+    split = {}
+    for k in ("sales", "expenses"):
+        part = df[df["k"] == k]
+        split[k] = part[["d", "v"]].rename(columns={"v": k}).sort_values("d").reset_index(drop=True)
+    return split["sales"], split["expenses"]
+
+@st.cache_data(ttl=15)
+def inventory_kpis():
+    conn = db.get_conn()
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS items,
+               SUM(i.available_stock > 0) AS in_stock,
+               SUM(i.available_stock <= i.low_stock_alert) AS low_stock,
+               SUM(i.available_stock <= 0) AS out_of_stock,
+               SUM(i.current_inventory_value) AS total_value
+          FROM inventory i
+          JOIN products p ON p.id = i.product_id
+        """
+    ).fetchone()
+    return {
+        "items": row["items"],
+        "in_stock": row["in_stock"] or 0,
+        "low_stock": row["low_stock"] or 0,
+        "out_of_stock": row["out_of_stock"] or 0,
+        "total_value": row["total_value"] or 0.0,
+    }
+
+# -------------------- Cached report queries --------------------
+# Aggregations run in SQLite so only the grouped rows reach pandas.
+@st.cache_data(ttl=30)
+def sales_by_day():
+    return pd.read_sql_query(
+        """
+        SELECT substr(s.billing_date,1,10) AS d, SUM(s.total_amount) AS total_amount
+          FROM sales s
+          JOIN products p ON p.id = s.product_id
+         GROUP BY 1
+         ORDER BY 1
+        """,
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=30)
+def sales_by_month():
+    return pd.read_sql_query(
+        """
+        SELECT substr(s.billing_date,1,7) AS m, SUM(s.total_amount) AS total_amount
+          FROM sales s
+          JOIN products p ON p.id = s.product_id
+         GROUP BY 1
+         ORDER BY 1
+        """,
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=60)
+def top_products_20():
+    return pd.read_sql_query(
+        """
+        SELECT p.name AS product_name, SUM(s.quantity) AS quantity, SUM(s.total_amount) AS sales
+          FROM sales s
+          JOIN products p ON p.id = s.product_id
+         GROUP BY p.name
+         ORDER BY 3 DESC
+         LIMIT 20
+        """,
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=60)
+def sales_by_channel():
+    return pd.read_sql_query(
+        """
+        SELECT s.sales_channel, SUM(s.total_amount) AS total_amount
+          FROM sales s
+          JOIN products p ON p.id = s.product_id
+         GROUP BY 1
+         ORDER BY 2 DESC
+        """,
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=30)
+def expenses_by_day():
+    return pd.read_sql_query(
+        "SELECT substr(purchase_date,1,10) AS d, SUM(total_cost) AS total_cost FROM expenses GROUP BY 1 ORDER BY 1",
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=30)
+def expenses_by_month():
+    return pd.read_sql_query(
+        "SELECT substr(purchase_date,1,7) AS m, SUM(total_cost) AS total_cost FROM expenses GROUP BY 1 ORDER BY 1",
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=30)
+def expenses_by_year():
+    return pd.read_sql_query(
+        "SELECT substr(purchase_date,1,4) AS y, SUM(total_cost) AS total_cost FROM expenses GROUP BY 1 ORDER BY 1",
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=60)
+def expenses_by_category():
+    return pd.read_sql_query(
+        """
+        SELECT category, SUM(total_cost) AS total_cost
+          FROM expenses
+         WHERE category IS NOT NULL
+         GROUP BY 1
+         ORDER BY 2 DESC
+        """,
+        db.get_conn(),
+    )
+
+@st.cache_data(ttl=60)
+def financial_totals():
+    row = db.get_conn().execute(
+        """
+        SELECT ROUND(COALESCE(SUM(total_amount),0), 2) AS rev,
+               ROUND(COALESCE(SUM(vat_amount),0), 2) AS vat_collected,
+               ROUND(COALESCE(SUM(net_of_vat),0), 2) AS net_sales,
+               (SELECT ROUND(COALESCE(SUM(total_cost),0), 2) FROM expenses) AS opex
+          FROM sales
+        """
+    ).fetchone()
+    return dict(row)
+
+# Statement tables keyed on the scalar totals: cheap to hash, and a rerun with
+# unchanged totals skips building the DataFrames.
+@st.cache_data(max_entries=8)
+def _pnl_frame(rev, vat_collected, net_sales, cogs, opex):
+    gross_profit = net_sales - cogs
+    operating_income = gross_profit - opex
+    return pd.DataFrame({
+        "Metric": ["Gross Sales", "VAT Collected", "Net Sales", "COGS (placeholder)", "Gross Profit", "Operating Expenses", "Operating Income"],
+        "Amount": [rev, vat_collected, net_sales, cogs, gross_profit, opex, operating_income],
+    })
+
+@st.cache_data(max_entries=8)
+def _cash_flow_frame(cash_inflows, cash_outflows):
+    return pd.DataFrame({
+        "Metric": ["Cash Inflows (Sales)", "Cash Outflows (Expenses)", "Net Cash Flow"],
+        "Amount": [cash_inflows, cash_outflows, cash_inflows - cash_outflows],
+    })
+
+# -------------------- Write statements --------------------
+# Hoisted so every save binds against the same SQL text and hits the
+# connection's statement cache instead of re-preparing.
+SQL_INSERT_STOCK_IN = "INSERT INTO stock_in_logs (stock_in_ts, product_id, stocks_added, status, notes) VALUES (?,?,?,?,?)"
+
+SQL_UPDATE_PRODUCT = """
+    UPDATE products
+       SET name=?, item_code=?, discount=?, item_cost=?, tax_amount=?, other_costs=?,
+           total_cost=?, selling_price=?, est_profit=?, profit_margin=?, notes=?
+     WHERE id=?
+"""
+
+SQL_UPDATE_INV_IN = """
+    UPDATE inventory
+       SET available_stock=COALESCE(available_stock,0)+?,
+           all_time_stock_in=COALESCE(all_time_stock_in,0)+?,
+           current_inventory_value=(COALESCE(available_stock,0)+?)*?,
+           status=CASE WHEN COALESCE(available_stock,0)+? > 0 THEN 'In Stock' ELSE 'Out of Stock' END
+     WHERE product_id=?
+"""
+
+SQL_INSERT_INV = """
+    INSERT INTO inventory (product_id, available_stock, low_stock_alert, status, current_inventory_value, all_time_stock_in, all_time_stock_out, all_time_sales)
+    VALUES (?,?,0,'In Stock',?,?,0,0.0)
+"""
+
+SQL_INSERT_SALE = """
+    INSERT INTO sales (billing_date, product_id, quantity, item_price, discount, total_amount,
+                       payment_status, sales_channel, customer_name, customer_tin, business_address,
+                       notes, vat_inclusive, vat_amount, net_of_vat)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+SQL_UPDATE_INV_OUT = """
+    UPDATE inventory
+       SET available_stock=MAX(COALESCE(available_stock,0)-?, 0),
+           all_time_stock_out=COALESCE(all_time_stock_out,0)+?,
+           all_time_sales=COALESCE(all_time_sales,0)+?,
+           current_inventory_value=MAX(COALESCE(available_stock,0)-?, 0)*?,
+           status=CASE WHEN COALESCE(available_stock,0)-? > 0 THEN 'In Stock' ELSE 'Out of Stock' END
+     WHERE product_id=?
+"""
+
+SQL_SALE_FOR_INVOICE = """
+    SELECT s.id, s.invoice_no, s.billing_date, s.customer_name, s.customer_tin, s.business_address,
+           s.quantity, s.item_price, s.discount, s.total_amount, s.vat_inclusive, s.vat_amount,
+           s.net_of_vat, p.name as product_name
+      FROM sales s
+      JOIN products p ON p.id=s.product_id
+     WHERE s.id=?
+"""
+
+SQL_SET_INVOICE_NO = "UPDATE sales SET invoice_no=? WHERE id=?"
+
+# Settings / Import batches (executemany over the planned rows).
+SQL_IMPORT_CODE_MAP = "SELECT id, item_code FROM products"
+SQL_IMPORT_INV_PIDS = "SELECT product_id FROM inventory"
+SQL_IMPORT_INSERT_PRODUCT = """
+    INSERT INTO products (name, item_code, discount, item_cost, tax_amount, other_costs,
+                          total_cost, selling_price, est_profit, profit_margin, notes)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+"""
+SQL_IMPORT_UPDATE_PRODUCT = """
+    UPDATE products SET
+      name=?, discount=?, item_cost=?, tax_amount=?, other_costs=?,
+      total_cost=?, selling_price=?, est_profit=?, profit_margin=?, notes=?
+    WHERE id=?
+"""
+SQL_IMPORT_INSERT_INV = """
+    INSERT INTO inventory (product_id, available_stock, low_stock_alert, status,
+                           current_inventory_value, all_time_stock_in, all_time_stock_out, all_time_sales)
+    VALUES (?,?,?,?,?,?,0,0.0)
+"""
+SQL_IMPORT_UPDATE_INV = "UPDATE inventory SET available_stock=?, low_stock_alert=?, status=?, current_inventory_value=? WHERE product_id=?"
+
+# -------------------- Cached listings --------------------
+# Keyed by (row count, max id): the cheap version probe runs every time, the
+# full read only when rows were added or removed. In-place updates are covered
+# by the clear_caches() calls on the write paths.
+def table_version(table: str):
+    return tuple(db.get_conn().execute(f"SELECT COUNT(*), COALESCE(MAX(id),0) FROM {table}").fetchone())
+
+SALES_LISTING_SQL = """
+    SELECT s.id, s.billing_date as "Billing Date", p.name as "Product", s.quantity as "Quantity",
+           s.item_price as "Item Price", s.discount as "Discount", s.total_amount as "Total Amount",
+           s.payment_status as "Payment Status", s.sales_channel as "Sales Channel",
+           s.customer_name as "Customer Name", s.customer_tin as "TIN Number",
+           s.business_address as "Business Address", s.notes as "Notes",
+           CASE WHEN s.vat_inclusive=1 THEN 'Yes' ELSE 'No' END as "VAT Inclusive",
+           s.vat_amount as "VAT", s.net_of_vat as "Net of VAT", s.invoice_no as "Invoice No"
+      FROM sales s
+      JOIN products p ON p.id = s.product_id
+      ORDER BY s.billing_date DESC, s.id DESC
+      LIMIT ? OFFSET ?
+"""
+
+STOCK_IN_LISTING_SQL = """
+    SELECT l.id, l.stock_in_ts as "Stock In DateTime", p.name as "Product Name",
+           l.stocks_added as "Stocks Added", l.status as "Status", l.notes as "Notes"
+      FROM stock_in_logs l
+      JOIN products p ON p.id = l.product_id
+     ORDER BY l.stock_in_ts DESC, l.id DESC
+     LIMIT ? OFFSET ?
+"""
+
+INVENTORY_LISTING_SQL = """
+    SELECT i.id, p.name as "Product Name", p.selling_price as "Item Price",
+           i.available_stock as "Available Stock", i.low_stock_alert as "Low Stock Alert",
+           i.status as "Status", i.current_inventory_value as "Current Inventory Value",
+           i.all_time_stock_in as "All Time Stock In", i.all_time_stock_out as "All Time Stock Out",
+           i.all_time_sales as "All Time Sales"
+      FROM inventory i
+      JOIN products p ON p.id = i.product_id
+      ORDER BY p.name
+"""
+
+# Sales, stock-in logs and expenses grow without bound, so they are read one
+# page at a time; the row count comes for free from table_version().
+PAGE_SIZE = 200
+
+def page_picker(ver, key: str):
+    total = ver[0]
+    pages = max((total - 1) // PAGE_SIZE + 1, 1)
+    page_idx = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=key) - 1
+    st.caption(f"{total:,} rows · page {page_idx + 1} of {pages}")
+    return int(page_idx)
+
+@st.cache_data(max_entries=16)
+def sales_listing(ver, page_idx=0):
+    return pd.read_sql_query(SALES_LISTING_SQL, db.get_conn(), params=(PAGE_SIZE, page_idx * PAGE_SIZE))
+
+@st.cache_data(max_entries=16)
+def stock_in_listing(ver, page_idx=0):
+    return pd.read_sql_query(STOCK_IN_LISTING_SQL, db.get_conn(), params=(PAGE_SIZE, page_idx * PAGE_SIZE))
+
+def frame_listing(name: str, ver, sql: str):
+    cache = _frame_cache()
+    hit = cache.get(name)
+    if hit is not None and hit[0] == ver:
+        return hit[1]
+    df = pd.read_sql_query(sql, db.get_conn())
+    cache[name] = (ver, df)
+    return df
+
+def inventory_listing(ver):
+    return frame_listing("inventory", ver, INVENTORY_LISTING_SQL)
+
+def products_listing(ver):
+    return frame_listing("products", ver, "SELECT * FROM products ORDER BY name")
+
+@st.cache_data(max_entries=16)
+def expenses_listing(ver, page_idx=0):
+    return pd.read_sql_query(
+        "SELECT * FROM expenses ORDER BY purchase_date DESC, id DESC LIMIT ? OFFSET ?",
+        db.get_conn(), params=(PAGE_SIZE, page_idx * PAGE_SIZE),
+    )
+
+def supplies_listing(ver):
+    return frame_listing("supplies", ver, "SELECT * FROM supplies ORDER BY item_description")
+
+@st.cache_data(ttl=60, max_entries=16)
+def load_table(name: str, ver, order_by: str = ""):
+    sql = f"SELECT * FROM {name}" + (f" ORDER BY {order_by}" if order_by else "")
+    return pd.read_sql_query(sql, db.get_conn())
 
 # -------------------- Sidebar --------------------
 st.sidebar.title("🍳 TakeOut RMS")
@@ -167,11 +575,7 @@ else:
     st.sidebar.info("Not logged in")
 
 # Navigation (viewer-level pages always visible when logged out)
-viewer_defaults = {"Dashboard", "Sales Reports", "Expense Reports", "Financial Statements", "Profile"}
-allowed_pages = sorted(
-    p for p in PAGES
-    if (user and ROLE_LEVEL[user["role"]] >= ROLE_LEVEL[REQUIRES[p]]) or p in viewer_defaults
-)
+allowed_pages = ALLOWED_BY_ROLE.get(user["role"], ALLOWED_BY_ROLE["guest"]) if user else ALLOWED_BY_ROLE["guest"]
 page = st.sidebar.radio("Go to", allowed_pages, index=0)
 
 # If not logged and page needs auth, show login/registration instead
@@ -184,18 +588,8 @@ if not ok:
 # -------------------- Dashboard --------------------
 if page == "Dashboard":
     st.title("📊 Dashboard")
-    with db.get_conn() as conn:
-        totals = {}
-        totals["products"] = conn.execute("SELECT COUNT(*) c FROM products").fetchone()["c"]
-        totals["inventory_value"] = conn.execute(
-            "SELECT SUM(current_inventory_value) s FROM inventory"
-        ).fetchone()["s"] or 0.0
-        totals["sales_all_time"] = conn.execute(
-            "SELECT SUM(total_amount) s FROM sales"
-        ).fetchone()["s"] or 0.0
-        totals["expenses_all_time"] = conn.execute(
-            "SELECT SUM(total_cost) s FROM expenses"
-        ).fetchone()["s"] or 0.0
+    today = date.today().isoformat()
+    totals = dashboard_totals(today)
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Total Products", totals["products"])
@@ -207,55 +601,19 @@ if page == "Dashboard":
     st.subheader("Quick Trends")
     left, right = st.columns(2)
 
-    with db.get_conn() as conn:
-        df_sales = pd.read_sql_query(
-            """
-            SELECT substr(billing_date,1,10) as d, SUM(total_amount) as sales
-            FROM sales
-            GROUP BY substr(billing_date,1,10)
-            ORDER BY d DESC
-            LIMIT 30
-            """,
-            conn,
-        ).sort_values("d")
+    df_sales, df_exp = daily_trends_30(today)
 
     with left:
         st.caption("Daily Sales (last 30 entries)")
         if not df_sales.empty:
-            import matplotlib.pyplot as plt
-            fig = plt.figure()
-            plt.plot(df_sales["d"], df_sales["sales"])
-            plt.xticks(rotation=45, ha="right")
-            plt.title("Daily Sales")
-            plt.xlabel("Date")
-            plt.ylabel("Sales")
-            st.pyplot(fig, use_container_width=True)
+            st.line_chart(df_sales.set_index("d")["sales"])
         else:
             st.info("No sales yet.")
 
-    with db.get_conn() as conn:
-        df_exp = pd.read_sql_query(
-            """
-            SELECT substr(purchase_date,1,10) as d, SUM(total_cost) as expenses
-            FROM expenses
-            GROUP BY substr(purchase_date,1,10)
-            ORDER BY d DESC
-            LIMIT 30
-            """,
-            conn,
-        ).sort_values("d")
-
     with right:
         st.caption("Daily Expenses (last 30 entries)")
         if not df_exp.empty:
-            import matplotlib.pyplot as plt
-            fig2 = plt.figure()
-            plt.plot(df_exp["d"], df_exp["expenses"])
-            plt.xticks(rotation=45, ha="right")
-            plt.title("Daily Expenses")
-            plt.xlabel("Date")
-            plt.ylabel("Expenses")
-            st.pyplot(fig2, use_container_width=True)
+            st.line_chart(df_exp.set_index("d")["expenses"])
         else:
             st.info("No expenses yet.")
 
@@ -264,268 +622,214 @@ if page == "Products & Pricing":
     st.title("🧾 Products & Pricing")
     st.caption("Create and manage products/services with cost build-up and profit analytics.")
 
-    with db.get_conn() as conn:
-        with st.form("add_product"):
-            st.subheader("Add / Update Product")
-            c1, c2 = st.columns([2, 1])
-            with c1:
-                name = st.text_input("Product/Service Name", key="p_name")
-                item_code = st.text_input("Item Code (SKU)", key="p_code")
-                discount = st.number_input("Discount", min_value=0.0, step=0.01)
-                item_cost = st.number_input("Item Cost", min_value=0.0, step=0.01)
-                tax_amount = st.number_input("Tax Amount", min_value=0.0, step=0.01)
-                other_costs = st.number_input("Other Costs", min_value=0.0, step=0.01)
-                selling_price = st.number_input("Item Selling Price", min_value=0.0, step=0.01)
-            with c2:
-                m = compute_profit_metrics(item_cost, tax_amount, other_costs, selling_price)
-                st.metric("Total Cost", peso(m["total_cost"]))
-                st.metric("Estimated Profit", peso(m["est_profit"]))
-                st.metric("Profit Margin", f"{m['profit_margin']*100:.2f}%")
-
-            notes = st.text_area("Notes", "")
-            pid_to_update = st.selectbox(
-                "Update Existing (optional)",
-                options=[None] + [r["id"] for r in conn.execute("SELECT id FROM products").fetchall()],
-            )
+    df = products_listing(table_version("products"))
+    with st.form("add_product"):
+        st.subheader("Add / Update Product")
+        c1, c2 = st.columns([2, 1])
+        with c1:
+            name = st.text_input("Product/Service Name", key="p_name")
+            item_code = st.text_input("Item Code (SKU)", key="p_code")
+            discount = st.number_input("Discount", min_value=0.0, step=0.01)
+            item_cost = st.number_input("Item Cost", min_value=0.0, step=0.01)
+            tax_amount = st.number_input("Tax Amount", min_value=0.0, step=0.01)
+            other_costs = st.number_input("Other Costs", min_value=0.0, step=0.01)
+            selling_price = st.number_input("Item Selling Price", min_value=0.0, step=0.01)
+        with c2:
+            m = compute_profit_metrics(item_cost, tax_amount, other_costs, selling_price)
+            st.metric("Total Cost", peso(m["total_cost"]))
+            st.metric("Estimated Profit", peso(m["est_profit"]))
+            st.metric("Profit Margin", f"{m['profit_margin']*100:.2f}%")
+
+        notes = st.text_area("Notes", "")
+        pid_to_update = st.selectbox(
+            "Update Existing (optional)",
+            options=[None] + df["id"].tolist(),
+        )
 
-            submitted = st.form_submit_button("Save Product")
-            if submitted:
-                if not name or not item_code:
-                    st.error("Name and Item Code are required.")
-                else:
-                    if pid_to_update:
+        submitted = st.form_submit_button("Save Product")
+        if submitted:
+            if not name or not item_code:
+                st.error("Name and Item Code are required.")
+            else:
+                if pid_to_update:
+                    with db.transaction() as conn:
                         conn.execute(
-                            """
-                            UPDATE products
-                               SET name=?, item_code=?, discount=?, item_cost=?, tax_amount=?, other_costs=?,
-                                   total_cost=?, selling_price=?, est_profit=?, profit_margin=?, notes=?
-                             WHERE id=?
-                            """,
+                            SQL_UPDATE_PRODUCT,
                             (
                                 name, item_code, discount, item_cost, tax_amount, other_costs,
                                 m["total_cost"], selling_price, m["est_profit"], m["profit_margin"], notes,
                                 pid_to_update,
                             ),
                         )
-                        st.success("Product updated.")
-                    else:
-                        conn.execute(
-                            """
-                            INSERT INTO products
-                              (name, item_code, discount, item_cost, tax_amount, other_costs,
-                               total_cost, selling_price, est_profit, profit_margin, notes)
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                            """,
-                            (
-                                name, item_code, discount, item_cost, tax_amount, other_costs,
-                                m["total_cost"], selling_price, m["est_profit"], m["profit_margin"], notes,
-                            ),
-                        )
-                        st.success("Product added.")
-                    st.rerun()
+                    st.success("Product updated.")
+                else:
+                    db.bulk_insert("products", db.PRODUCT_COLS, [(
+                        name, item_code, discount, item_cost, tax_amount, other_costs,
+                        m["total_cost"], selling_price, m["est_profit"], m["profit_margin"], notes,
+                    )])
+                    st.success("Product added.")
+                clear_caches()
+                st.rerun()
 
-        st.markdown("---")
-        df = pd.read_sql_query("SELECT * FROM products ORDER BY name", conn)
-        st.dataframe(df, use_container_width=True)
-
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("Average Cost", peso(df["total_cost"].mean() if not df.empty else 0))
-        c2.metric("Average Item Price", peso(df["selling_price"].mean() if not df.empty else 0))
-        c3.metric("Average Gross Profit", peso(df["est_profit"].mean() if not df.empty else 0))
-        c4.metric("Average Profit Margin", f"{(df['profit_margin'].mean()*100) if not df.empty else 0:.2f}%")
-
-        if not df.empty:
-            del_id = st.selectbox("Delete Product ID", options=[None] + df["id"].tolist())
-            if st.button("Delete Selected Product") and del_id:
+    st.markdown("---")
+    st.dataframe(df, use_container_width=True)
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Average Cost", peso(df["total_cost"].mean() if not df.empty else 0))
+    c2.metric("Average Item Price", peso(df["selling_price"].mean() if not df.empty else 0))
+    c3.metric("Average Gross Profit", peso(df["est_profit"].mean() if not df.empty else 0))
+    c4.metric("Average Profit Margin", f"{(df['profit_margin'].mean()*100) if not df.empty else 0:.2f}%")
+
+    if not df.empty:
+        del_id = st.selectbox("Delete Product ID", options=[None] + df["id"].tolist())
+        if st.button("Delete Selected Product") and del_id:
+            with db.transaction() as conn:
                 conn.execute("DELETE FROM products WHERE id=?", (int(del_id),))
-                st.warning("Product deleted.")
-                st.rerun()
+            st.warning("Product deleted.")
+            clear_caches()
+            st.rerun()
 
 # -------------------- Inventory --------------------
-if page == "Inventory":
+# Inventory and Sales run as fragments: widget changes inside them rerun only
+# the page body, not the sidebar/sync/auth preamble. st.rerun() after a save
+# still reruns the whole app.
+@st.fragment
+def inventory_page():
     st.title("📦 Inventory")
     st.caption("Stock-in logs and current inventory status.")
-    with db.get_conn() as conn:
-        opts = product_options()
-        with st.form("stock_in_form"):
-            st.subheader("Stock In")
-            pid_label = st.selectbox("Product", options=list(opts.keys()))
-            qty = st.number_input("Stocks Added", min_value=1, step=1)
-            status = st.selectbox("Status", options=["Stock In", "Adjustment"])
-            notes = st.text_input("Notes", "")
-            submitted = st.form_submit_button("Add Stock")
-            if submitted:
-                product_id = opts[pid_label]
-                ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pmap = product_map()
+    with st.form("stock_in_form"):
+        st.subheader("Stock In")
+        pid_label = st.selectbox("Product", options=pmap.index)
+        qty = st.number_input("Stocks Added", min_value=1, step=1)
+        status = st.selectbox("Status", options=["Stock In", "Adjustment"])
+        notes = st.text_input("Notes", "")
+        submitted = st.form_submit_button("Add Stock")
+        if submitted:
+            product_id = int(pmap.at[pid_label, "id"])
+            price = float(pmap.at[pid_label, "selling_price"])
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with db.transaction() as conn:
                 conn.execute(
-                    "INSERT INTO stock_in_logs (stock_in_ts, product_id, stocks_added, status, notes) VALUES (?,?,?,?,?)",
+                    SQL_INSERT_STOCK_IN,
                     (ts, product_id, int(qty), status, notes),
                 )
-                row = conn.execute("SELECT * FROM inventory WHERE product_id=?", (product_id,)).fetchone()
-                price = (conn.execute("SELECT selling_price FROM products WHERE id=?", (product_id,)).fetchone() or {}).get("selling_price", 0.0) or 0.0
-                if row:
-                    new_avail = (row["available_stock"] or 0) + int(qty)
-                    conn.execute(
-                        """
-                        UPDATE inventory
-                           SET available_stock=?,
-                               all_time_stock_in=COALESCE(all_time_stock_in,0)+?,
-                               current_inventory_value=?,
-                               status=CASE WHEN ? > 0 THEN 'In Stock' ELSE 'Out of Stock' END
-                         WHERE product_id=?
-                        """,
-                        (new_avail, int(qty), new_avail * price, new_avail, product_id),
-                    )
-                else:
+                # Bump the existing inventory row in place; seed one if the product has none yet.
+                cur = conn.execute(
+                    SQL_UPDATE_INV_IN,
+                    (int(qty), int(qty), int(qty), price, int(qty), product_id),
+                )
+                if cur.rowcount == 0:
                     conn.execute(
-                        """
-                        INSERT INTO inventory (product_id, available_stock, low_stock_alert, status, current_inventory_value, all_time_stock_in, all_time_stock_out, all_time_sales)
-                        VALUES (?,?,?,?,?,?,?,?)
-                        """,
-                        (product_id, int(qty), 0, "In Stock", int(qty) * price, int(qty), 0, 0.0),
+                        SQL_INSERT_INV,
+                        (product_id, int(qty), int(qty) * price, int(qty)),
                     )
-                st.success("Stock in recorded.")
-                st.rerun()
+            st.success("Stock in recorded.")
+            clear_caches()
+            st.rerun()
 
-        st.markdown("---")
-        st.subheader("Stock-in Logs")
-        logs = pd.read_sql_query(
-            """
-            SELECT l.id, l.stock_in_ts as "Stock In DateTime", p.name as "Product Name",
-                   l.stocks_added as "Stocks Added", l.status as "Status", l.notes as "Notes"
-              FROM stock_in_logs l
-              JOIN products p ON p.id = l.product_id
-             ORDER BY l.stock_in_ts DESC
-            """,
-            conn,
-        )
-        st.dataframe(logs, use_container_width=True)
-
-        st.subheader("Inventory Status")
-        inv_df = pd.read_sql_query(
-            """
-            SELECT i.id, p.name as "Product Name", p.selling_price as "Item Price",
-                   i.available_stock as "Available Stock", i.low_stock_alert as "Low Stock Alert",
-                   i.status as "Status", i.current_inventory_value as "Current Inventory Value",
-                   i.all_time_stock_in as "All Time Stock In", i.all_time_stock_out as "All Time Stock Out",
-                   i.all_time_sales as "All Time Sales"
-              FROM inventory i
-              JOIN products p ON p.id = i.product_id
-              ORDER BY p.name
-            """,
-            conn,
-        )
-        st.dataframe(inv_df, use_container_width=True)
+    st.markdown("---")
+    st.subheader("Stock-in Logs")
+    ver = table_version("stock_in_logs")
+    logs = stock_in_listing(ver, page_picker(ver, "stock_in_page"))
+    st.dataframe(logs, use_container_width=True)
 
-        total_val = inv_df["Current Inventory Value"].sum() if not inv_df.empty else 0.0
-        st.metric("Total Inventory Value", peso(total_val))
+    st.subheader("Inventory Status")
+    inv_df = inventory_listing(table_version("inventory"))
+    st.dataframe(inv_df, use_container_width=True)
 
-        if not inv_df.empty:
-            in_stock = (inv_df["Available Stock"] > 0).sum()
-            low_stock = (inv_df["Available Stock"] <= inv_df["Low Stock Alert"]).sum()
-            out_of_stock = (inv_df["Available Stock"] <= 0).sum()
-            c1, c2, c3 = st.columns(3)
-            c1.metric("In Stock", int(in_stock))
-            c2.metric("Low Stock", int(low_stock))
-            c3.metric("Out of Stock", int(out_of_stock))
+    kpis = inventory_kpis()
+    st.metric("Total Inventory Value", peso(kpis["total_value"]))
+
+    if kpis["items"]:
+        c1, c2, c3 = st.columns(3)
+        c1.metric("In Stock", int(kpis["in_stock"]))
+        c2.metric("Low Stock", int(kpis["low_stock"]))
+        c3.metric("Out of Stock", int(kpis["out_of_stock"]))
+
+if page == "Inventory":
+    inventory_page()
 
 # -------------------- Sales & Invoicing --------------------
-if page == "Sales & Invoicing":
+# Drive uploads run on a shared worker pool so generating an invoice only
+# costs the local write; the status fragment below polls the futures.
+@st.cache_resource
+def uploader():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="drive-upload")
+
+@st.fragment(run_every=2)
+def upload_status():
+    # Rendered (and polling) only while uploads are pending; once any finishes
+    # a full run reports it, and stops polling when none are left.
+    uploads = st.session_state.get("uploads", [])
+    if any(fut.done() for _, fut in uploads):
+        st.rerun(scope="app")
+    for label, _ in uploads:
+        st.caption(f"⏳ Uploading {label} to Drive…")
+
+@st.fragment
+def sales_page():
     st.title("🧾 Sales & Invoicing")
-    with db.get_conn() as conn:
-        opts = product_options()
-        with st.form("sales_form"):
-            st.subheader("Record Sale")
-            billing_date = st.date_input("Billing Date", value=date.today())
-            pid_label = st.selectbox("Product", options=list(opts.keys()))
-            qty = st.number_input("Quantity", min_value=1, step=1)
-            item_price = st.number_input("Item Price", min_value=0.0, step=0.01)
-            discount = st.number_input("Discount", min_value=0.0, step=0.01)
-            vat_incl = st.checkbox("VAT Inclusive?", value=True)
-            payment_status = st.selectbox("Payment Status", options=["Paid", "Unpaid", "Partially Paid"])
-            sales_channel = st.selectbox("Sales Channel", options=["Walk-in", "Delivery", "Online", "Catering"])
-            customer_name = st.text_input("Customer Name")
-            customer_tin = st.text_input("TIN Number")
-            business_address = st.text_input("Business Address")
-            notes = st.text_area("Notes", "")
-            submit = st.form_submit_button("Save Sale")
-
-            if submit:
-                product_id = opts[pid_label]
-                line_total_gross = (item_price * qty) - discount
-                vat_amt, net_of_vat = compute_vat(vat_incl, line_total_gross)
+    pmap = product_map()
+    with st.form("sales_form"):
+        st.subheader("Record Sale")
+        billing_date = st.date_input("Billing Date", value=date.today())
+        pid_label = st.selectbox("Product", options=pmap.index)
+        qty = st.number_input("Quantity", min_value=1, step=1)
+        item_price = st.number_input("Item Price", min_value=0.0, step=0.01)
+        discount = st.number_input("Discount", min_value=0.0, step=0.01)
+        vat_incl = st.checkbox("VAT Inclusive?", value=True)
+        payment_status = st.selectbox("Payment Status", options=["Paid", "Unpaid", "Partially Paid"])
+        sales_channel = st.selectbox("Sales Channel", options=["Walk-in", "Delivery", "Online", "Catering"])
+        customer_name = st.text_input("Customer Name")
+        customer_tin = st.text_input("TIN Number")
+        business_address = st.text_input("Business Address")
+        notes = st.text_area("Notes", "")
+        submit = st.form_submit_button("Save Sale")
+
+        if submit:
+            product_id = int(pmap.at[pid_label, "id"])
+            price = float(pmap.at[pid_label, "selling_price"])
+            line_total_gross = (item_price * qty) - discount
+            vat_amt, net_of_vat = compute_vat(vat_incl, line_total_gross)
+            with db.transaction() as conn:
                 conn.execute(
-                    """
-                    INSERT INTO sales (billing_date, product_id, quantity, item_price, discount, total_amount,
-                                       payment_status, sales_channel, customer_name, customer_tin, business_address,
-                                       notes, vat_inclusive, vat_amount, net_of_vat)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    """,
+                    SQL_INSERT_SALE,
                     (
                         ymd(billing_date), product_id, int(qty), item_price, discount, line_total_gross,
                         payment_status, sales_channel, customer_name, customer_tin, business_address,
                         notes, 1 if vat_incl else 0, vat_amt, net_of_vat,
                     ),
                 )
-                inv_row = conn.execute("SELECT * FROM inventory WHERE product_id=?", (product_id,)).fetchone()
-                price = (conn.execute("SELECT selling_price FROM products WHERE id=?", (product_id,)).fetchone() or {}).get("selling_price", 0.0) or 0.0
-                if inv_row:
-                    new_avail = max((inv_row["available_stock"] or 0) - int(qty), 0)
-                    conn.execute(
-                        """
-                        UPDATE inventory
-                           SET available_stock=?,
-                               all_time_stock_out=COALESCE(all_time_stock_out,0)+?,
-                               all_time_sales=COALESCE(all_time_sales,0)+?,
-                               current_inventory_value=?,
-                               status=CASE WHEN ? > 0 THEN 'In Stock' ELSE 'Out of Stock' END
-                         WHERE product_id=?
-                        """,
-                        (new_avail, int(qty), line_total_gross, new_avail * price, new_avail, product_id),
-                    )
-                st.success("Sale recorded.")
-                st.rerun()
+                conn.execute(
+                    SQL_UPDATE_INV_OUT,
+                    (int(qty), int(qty), line_total_gross, int(qty), price, int(qty), product_id),
+                )
+            st.success("Sale recorded.")
+            clear_caches()
+            st.rerun()
 
     st.markdown("---")
-    with db.get_conn() as conn:
-        sales_df = pd.read_sql_query(
-            """
-            SELECT s.id, s.billing_date as "Billing Date", p.name as "Product", s.quantity as "Quantity",
-                   s.item_price as "Item Price", s.discount as "Discount", s.total_amount as "Total Amount",
-                   s.payment_status as "Payment Status", s.sales_channel as "Sales Channel",
-                   s.customer_name as "Customer Name", s.customer_tin as "TIN Number",
-                   s.business_address as "Business Address", s.notes as "Notes",
-                   CASE WHEN s.vat_inclusive=1 THEN 'Yes' ELSE 'No' END as "VAT Inclusive",
-                   s.vat_amount as "VAT", s.net_of_vat as "Net of VAT", s.invoice_no as "Invoice No"
-              FROM sales s
-              JOIN products p ON p.id = s.product_id
-              ORDER BY s.billing_date DESC, s.id DESC
-            """,
-            conn,
-        )
     st.subheader("Sales Listing")
+    ver = table_version("sales")
+    sales_df = sales_listing(ver, page_picker(ver, "sales_page"))
     st.dataframe(sales_df, use_container_width=True)
 
     st.subheader("Invoice Generator")
     inv_id = st.selectbox("Select Sale ID for Invoice", options=[None] + sales_df["id"].tolist() if not sales_df.empty else [None])
     if st.button("Generate Invoice HTML") and inv_id:
-        with db.get_conn() as conn:
-            row = conn.execute(
-                """
-                SELECT s.*, p.name as product_name
-                  FROM sales s
-                  JOIN products p ON p.id=s.product_id
-                 WHERE s.id=?
-                """,
-                (int(inv_id),),
-            ).fetchone()
+        row = db.get_conn().execute(
+            SQL_SALE_FOR_INVOICE,
+            (int(inv_id),),
+        ).fetchone()
         if not row:
             st.error("Sale not found.")
         else:
             invoice_no = row["invoice_no"] or f"INV-{row['id']:06d}"
             if not row["invoice_no"]:
-                with db.get_conn() as conn:
-                    conn.execute("UPDATE sales SET invoice_no=? WHERE id=?", (invoice_no, int(inv_id)))
+                with db.transaction() as conn:
+                    conn.execute(SQL_SET_INVOICE_NO, (invoice_no, int(inv_id)))
+                clear_caches()
 
             rows = [{
                 "product_name": row["product_name"],
@@ -554,260 +858,195 @@ if page == "Sales & Invoicing":
             file_path = os.path.join(out_dir, f"{invoice_no}.html")
             inv.save_invoice_html(file_path, html)
 
-            # Optional upload to Drive (only if configured)
+            # Kept in session state so the download survives the full rerun below.
+            st.session_state["invoice"] = (inv_id, invoice_no, file_path)
+
+            # Optional upload to Drive (only if configured), in the background
             if has_drive_secrets():
-                try:
-                    from modules import gdrive
-                    fid = gdrive.upload_file(file_path, st.secrets["gdrive"]["folder_id"])
-                    st.info(f"Invoice uploaded to Drive (file id: {fid})")
-                except Exception as e:
-                    st.warning(f"Drive upload skipped: {e}")
+                from modules import gdrive
+                fut = uploader().submit(gdrive.upload_file, file_path, st.secrets["gdrive"]["folder_id"])
+                st.session_state.setdefault("uploads", []).append((invoice_no, fut))
+                # A fragment rerun never reaches the sidebar status at the end
+                # of the script; a full run brings it up.
+                st.rerun(scope="app")
+
+    invoice = st.session_state.get("invoice")
+    if invoice and inv_id and invoice[0] == inv_id:
+        _, invoice_no, file_path = invoice
+        st.success(f"Invoice generated: {file_path}")
+        with open(file_path, "rb") as f:
+            st.download_button("Download Invoice HTML", f, file_name=f"{invoice_no}.html", mime="text/html")
 
-            st.success(f"Invoice generated: {file_path}")
-            with open(file_path, "rb") as f:
-                st.download_button("Download Invoice HTML", f, file_name=f"{invoice_no}.html", mime="text/html")
+if page == "Sales & Invoicing":
+    sales_page()
 
 # -------------------- Expenses --------------------
 if page == "Expenses":
     st.title("💸 Expenses")
-    with db.get_conn() as conn:
-        with st.form("expenses_form"):
-            purchase_date = st.date_input("Purchase Date", value=date.today())
-            category = st.text_input("Category")
-            description = st.text_input("Item Description")
-            total_cost = st.number_input("Total Cost", min_value=0.0, step=0.01)
-            status = st.selectbox("Status", options=["Posted", "Pending", "Cancelled"])
-            receipt_no = st.text_input("Receipt No")
-            vendor_name = st.text_input("Vendor Name")
-            vendor_tin = st.text_input("TIN No")
-            business_address = st.text_input("Business Address")
-            notes = st.text_area("Notes", "")
-            submitted = st.form_submit_button("Save Expense")
-            if submitted:
-                conn.execute(
-                    """
-                    INSERT INTO expenses (purchase_date, category, description, total_cost, status, receipt_no, vendor_name, vendor_tin, business_address, notes)
-                    VALUES (?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    (ymd(purchase_date), category, description, total_cost, status, receipt_no, vendor_name, vendor_tin, business_address, notes),
-                )
-                st.success("Expense saved.")
-                st.rerun()
+    with st.form("expenses_form"):
+        purchase_date = st.date_input("Purchase Date", value=date.today())
+        category = st.text_input("Category")
+        description = st.text_input("Item Description")
+        total_cost = st.number_input("Total Cost", min_value=0.0, step=0.01)
+        status = st.selectbox("Status", options=["Posted", "Pending", "Cancelled"])
+        receipt_no = st.text_input("Receipt No")
+        vendor_name = st.text_input("Vendor Name")
+        vendor_tin = st.text_input("TIN No")
+        business_address = st.text_input("Business Address")
+        notes = st.text_area("Notes", "")
+        submitted = st.form_submit_button("Save Expense")
+        if submitted:
+            db.bulk_insert("expenses", db.EXPENSE_COLS, [
+                (ymd(purchase_date), category, description, total_cost, status, receipt_no, vendor_name, vendor_tin, business_address, notes),
+            ])
+            st.success("Expense saved.")
+            clear_caches()
+            st.rerun()
 
-        st.markdown("---")
-        df = pd.read_sql_query("SELECT * FROM expenses ORDER BY purchase_date DESC, id DESC", conn)
-        st.dataframe(df, use_container_width=True)
+    st.markdown("---")
+    ver = table_version("expenses")
+    df = expenses_listing(ver, page_picker(ver, "expenses_page"))
+    st.dataframe(df, use_container_width=True)
 
 # -------------------- Supplies --------------------
 if page == "Supplies":
     st.title("🧰 Supplies Inventory")
-    with db.get_conn() as conn:
-        with st.form("supplies_form"):
-            item_description = st.text_input("Item Description")
-            supplier = st.text_input("Supplier")
-            units_per_piece = st.number_input("Units per Piece", min_value=0.0, step=0.01, value=1.0)
-            unit_symbol = st.text_input("Unit Symbol (e.g., g, ml, pcs)")
-            item_cost = st.number_input("Item Cost", min_value=0.0, step=0.01)
-            available_stocks = st.number_input("Available Stocks", min_value=0.0, step=0.01)
-            low_stock_alert = st.number_input("Low Stock Alert Level", min_value=0.0, step=0.01, value=0.0)
-            status = st.selectbox("Status", options=["In Stock", "Low Stock", "Out of Stock"])
-            notes = st.text_area("Notes", "")
-            submitted = st.form_submit_button("Save Supply")
-            if submitted:
-                conn.execute(
-                    """
-                    INSERT INTO supplies (item_description, supplier, units_per_piece, unit_symbol, item_cost, last_updated, available_stocks, low_stock_alert, status, inventory_value, notes)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    (item_description, supplier, units_per_piece, unit_symbol, item_cost, ymd(datetime.now()), available_stocks, low_stock_alert, status, item_cost * available_stocks, notes),
-                )
-                st.success("Supply saved.")
-                st.rerun()
+    with st.form("supplies_form"):
+        item_description = st.text_input("Item Description")
+        supplier = st.text_input("Supplier")
+        units_per_piece = st.number_input("Units per Piece", min_value=0.0, step=0.01, value=1.0)
+        unit_symbol = st.text_input("Unit Symbol (e.g., g, ml, pcs)")
+        item_cost = st.number_input("Item Cost", min_value=0.0, step=0.01)
+        available_stocks = st.number_input("Available Stocks", min_value=0.0, step=0.01)
+        low_stock_alert = st.number_input("Low Stock Alert Level", min_value=0.0, step=0.01, value=0.0)
+        status = st.selectbox("Status", options=["In Stock", "Low Stock", "Out of Stock"])
+        notes = st.text_area("Notes", "")
+        submitted = st.form_submit_button("Save Supply")
+        if submitted:
+            db.bulk_insert("supplies", db.SUPPLY_COLS, [
+                (item_description, supplier, units_per_piece, unit_symbol, item_cost, ymd(datetime.now()), available_stocks, low_stock_alert, status, item_cost * available_stocks, notes),
+            ])
+            st.success("Supply saved.")
+            clear_caches()
+            st.rerun()
 
-        st.markdown("---")
-        df = pd.read_sql_query("SELECT * FROM supplies ORDER BY item_description", conn)
-        st.dataframe(df, use_container_width=True)
+    st.markdown("---")
+    df = supplies_listing(table_version("supplies"))
+    st.dataframe(df, use_container_width=True)
 
 # -------------------- Sales Reports --------------------
 if page == "Sales Reports":
     st.title("📈 Sales Reports")
-    with db.get_conn() as conn:
-        sales = pd.read_sql_query(
-            """
-            SELECT s.*, p.name as product_name
-              FROM sales s
-              JOIN products p ON p.id = s.product_id
-            """,
-            conn,
-        )
-        exp = pd.read_sql_query("SELECT * FROM expenses", conn)
+    g_daily = sales_by_day()
 
-    if sales.empty:
+    if g_daily.empty:
         st.info("No sales data yet.")
     else:
         st.subheader("Daily Sales Breakdown")
-        daily = sales.copy()
-        daily["d"] = daily["billing_date"].str.slice(0, 10)
-        g_daily = daily.groupby("d", as_index=False)["total_amount"].sum()
         st.dataframe(g_daily, use_container_width=True)
 
         st.subheader("Monthly Sales Breakdown")
-        monthly = sales.copy()
-        monthly["m"] = monthly["billing_date"].str.slice(0, 7)
-        g_month = monthly.groupby("m", as_index=False)["total_amount"].sum()
+        g_month = sales_by_month()
         st.dataframe(g_month, use_container_width=True)
 
         st.subheader("Top 20 Best Selling Product")
-        top = (
-            sales.groupby("product_name", as_index=False)
-            .agg(quantity=("quantity", "sum"), sales=("total_amount", "sum"))
-            .sort_values("sales", ascending=False)
-            .head(20)
-        )
+        top = top_products_20()
         st.dataframe(top, use_container_width=True)
 
         st.subheader("Top Sales Channel")
-        chan = (
-            sales.groupby("sales_channel", as_index=False)["total_amount"]
-            .sum()
-            .sort_values("total_amount", ascending=False)
-        )
+        chan = sales_by_channel()
         st.dataframe(chan, use_container_width=True)
 
         st.markdown("---")
         st.subheader("Trends")
-        import matplotlib.pyplot as plt
-
-        exp = exp.copy()
-        exp["m"] = exp["purchase_date"].str.slice(0, 7) if not exp.empty else pd.Series(dtype=str)
-        g_exp_m = (exp.groupby("m", as_index=False)["total_cost"].sum() if not exp.empty
-                   else pd.DataFrame(columns=["m", "total_cost"]))
+        series_names = {"total_amount": "Sales", "total_cost": "Expenses"}
 
-        fig1 = plt.figure()
-        plt.plot(g_month["m"], g_month["total_amount"], label="Sales")
+        g_exp_m = expenses_by_month()
+        m_merge = g_month
         if not g_exp_m.empty:
             m_merge = pd.merge(g_month, g_exp_m, on="m", how="left").fillna(0)
-            plt.plot(m_merge["m"], m_merge["total_cost"], label="Expenses")
-        plt.xticks(rotation=45, ha="right")
-        plt.title("Monthly Sales vs Expenses")
-        plt.xlabel("Month")
-        plt.ylabel("Amount")
-        plt.legend()
-        st.pyplot(fig1, use_container_width=True)
-
-        exp["d"] = exp["purchase_date"].str.slice(0, 10) if not exp.empty else pd.Series(dtype=str)
-        g_exp_d = (exp.groupby("d", as_index=False)["total_cost"].sum() if not exp.empty
-                   else pd.DataFrame(columns=["d", "total_cost"]))
-
-        fig2 = plt.figure()
-        plt.plot(g_daily["d"], g_daily["total_amount"], label="Sales")
+        st.caption("Monthly Sales vs Expenses")
+        st.line_chart(m_merge.set_index("m").rename(columns=series_names))
+
+        g_exp_d = expenses_by_day()
+        d_merge = g_daily
         if not g_exp_d.empty:
             d_merge = pd.merge(g_daily, g_exp_d, on="d", how="left").fillna(0)
-            plt.plot(d_merge["d"], d_merge["total_cost"], label="Expenses")
-        plt.xticks(rotation=45, ha="right")
-        plt.title("Daily Sales vs Expenses")
-        plt.xlabel("Date")
-        plt.ylabel("Amount")
-        plt.legend()
-        st.pyplot(fig2, use_container_width=True)
+        st.caption("Daily Sales vs Expenses")
+        st.line_chart(d_merge.set_index("d").rename(columns=series_names))
 
 # -------------------- Expense Reports --------------------
 if page == "Expense Reports":
     st.title("🧮 Expense Reports")
-    with db.get_conn() as conn:
-        exp = pd.read_sql_query("SELECT * FROM expenses", conn)
+    g_d = expenses_by_day()
 
-    if exp.empty:
+    if g_d.empty:
         st.info("No expenses yet.")
     else:
-        st.metric("All-Time Expenses", peso(exp["total_cost"].sum()))
+        st.metric("All-Time Expenses", peso(g_d["total_cost"].sum()))
         st.subheader("Categories Breakdown")
-        cats = exp.groupby("category", as_index=False)["total_cost"].sum().sort_values("total_cost", ascending=False)
+        cats = expenses_by_category()
         st.dataframe(cats, use_container_width=True)
         st.subheader("Daily Expense Trend")
-        exp["d"] = exp["purchase_date"].str.slice(0, 10)
-        g_d = exp.groupby("d", as_index=False)["total_cost"].sum()
         st.dataframe(g_d, use_container_width=True)
         st.subheader("Monthly Expense Breakdown")
-        exp["m"] = exp["purchase_date"].str.slice(0, 7)
-        g_m = exp.groupby("m", as_index=False)["total_cost"].sum()
+        g_m = expenses_by_month()
         st.dataframe(g_m, use_container_width=True)
         st.subheader("Yearly Expense Breakdown")
-        exp["y"] = exp["purchase_date"].str.slice(0, 4)
-        g_y = exp.groupby("y", as_index=False)["total_cost"].sum()
+        g_y = expenses_by_year()
         st.dataframe(g_y, use_container_width=True)
 
 # -------------------- Targets --------------------
 if page == "Targets":
     st.title("🎯 Target Goals")
-    with db.get_conn() as conn:
-        with st.form("targets_form"):
-            period = st.text_input("Period (YYYY-MM)", value=datetime.now().strftime("%Y-%m"))
-            sales_target = st.number_input("Sales Target", min_value=0.0, step=0.01)
-            expense_target = st.number_input("Expense Target", min_value=0.0, step=0.01)
-            profit_target = st.number_input("Profit Target", min_value=0.0, step=0.01)
-            notes = st.text_area("Notes", "")
-            submitted = st.form_submit_button("Save Target")
-            if submitted:
+    with st.form("targets_form"):
+        period = st.text_input("Period (YYYY-MM)", value=datetime.now().strftime("%Y-%m"))
+        sales_target = st.number_input("Sales Target", min_value=0.0, step=0.01)
+        expense_target = st.number_input("Expense Target", min_value=0.0, step=0.01)
+        profit_target = st.number_input("Profit Target", min_value=0.0, step=0.01)
+        notes = st.text_area("Notes", "")
+        submitted = st.form_submit_button("Save Target")
+        if submitted:
+            with db.transaction() as conn:
                 conn.execute(
                     "INSERT INTO targets (period, sales_target, expense_target, profit_target, notes) VALUES (?,?,?,?,?)",
                     (period, sales_target, expense_target, profit_target, notes),
                 )
-                st.success("Target saved.")
-                st.rerun()
+            st.success("Target saved.")
+            st.rerun()
 
     st.markdown("---")
-    with db.get_conn() as conn:
-        df = pd.read_sql_query("SELECT * FROM targets ORDER BY period DESC", conn)
+    df = load_table("targets", table_version("targets"), "period DESC")
     st.dataframe(df, use_container_width=True)
 
 # -------------------- Financial Statements --------------------
 if page == "Financial Statements":
     st.title("📒 Financial Statements")
-    with db.get_conn() as conn:
-        sales = pd.read_sql_query("SELECT * FROM sales", conn)
-        exp = pd.read_sql_query("SELECT * FROM expenses", conn)
-
-    rev = sales["total_amount"].sum() if not sales.empty else 0.0
-    vat_collected = sales["vat_amount"].sum() if not sales.empty else 0.0
-    net_sales = sales["net_of_vat"].sum() if not sales.empty else 0.0
+    fin = financial_totals()
     cogs = 0.0  # placeholder
-    gross_profit = net_sales - cogs
-    opex = exp["total_cost"].sum() if not exp.empty else 0.0
-    operating_income = gross_profit - opex
-    cash_inflows = rev
-    cash_outflows = opex
-    net_cash_flow = cash_inflows - cash_outflows
 
     st.subheader("Income Statement (P&L)")
-    st.write(pd.DataFrame({
-        "Metric": ["Gross Sales", "VAT Collected", "Net Sales", "COGS (placeholder)", "Gross Profit", "Operating Expenses", "Operating Income"],
-        "Amount": [rev, vat_collected, net_sales, cogs, gross_profit, opex, operating_income],
-    }))
+    st.write(_pnl_frame(fin["rev"], fin["vat_collected"], fin["net_sales"], cogs, fin["opex"]))
 
     st.subheader("Cash Flow Statement (Simplified)")
-    st.write(pd.DataFrame({
-        "Metric": ["Cash Inflows (Sales)", "Cash Outflows (Expenses)", "Net Cash Flow"],
-        "Amount": [cash_inflows, cash_outflows, net_cash_flow],
-    }))
+    st.write(_cash_flow_frame(fin["rev"], fin["opex"]))
 
 # -------------------- Shareholders --------------------
 if page == "Shareholders":
     st.title("🧑‍🤝‍🧑 Shareholders")
-    with db.get_conn() as conn:
-        with st.form("shareholder_form"):
-            name = st.text_input("Name")
-            pct = st.number_input("Ownership %", min_value=0.0, max_value=100.0, step=0.01)
-            notes = st.text_area("Notes", "")
-            submitted = st.form_submit_button("Save Shareholder")
-            if submitted:
+    with st.form("shareholder_form"):
+        name = st.text_input("Name")
+        pct = st.number_input("Ownership %", min_value=0.0, max_value=100.0, step=0.01)
+        notes = st.text_area("Notes", "")
+        submitted = st.form_submit_button("Save Shareholder")
+        if submitted:
+            with db.transaction() as conn:
                 conn.execute("INSERT INTO shareholders (name, ownership_pct, notes) VALUES (?,?,?)", (name, pct, notes))
-                st.success("Shareholder saved.")
-                st.rerun()
+            st.success("Shareholder saved.")
+            st.rerun()
 
     st.markdown("---")
-    with db.get_conn() as conn:
-        df = pd.read_sql_query("SELECT * FROM shareholders ORDER BY ownership_pct DESC", conn)
+    df = load_table("shareholders", table_version("shareholders"), "ownership_pct DESC")
     st.dataframe(df, use_container_width=True)
 
 # -------------------- Profile --------------------
@@ -835,6 +1074,8 @@ if page == "Profile":
 if page == "Admin / Users":
     st.title("🛡️ Admin / Users")
     st.caption("Approve registrations, approve/deny password changes, manage roles & activation.")
+    # Buttons only mark the page dirty; one rerun at the end picks up every change.
+    dirty = False
 
     st.subheader("Pending Registrations")
     pend = auth.list_pending_users()
@@ -849,11 +1090,11 @@ if page == "Admin / Users":
                 ok = auth.approve_user(p["id"], role_sel)
                 if ok:
                     st.success(f"Approved {p['username']} as {role_sel}.")
-                    st.rerun()
+                    dirty = True
             if c4.button("Deny", key=f"deny_{p['id']}"):
                 auth.deny_user(p["id"])
                 st.warning(f"Denied {p['username']}.")
-                st.rerun()
+                dirty = True
             c5.write(p["created_at"])
 
     st.markdown("---")
@@ -869,11 +1110,11 @@ if page == "Admin / Users":
                 ok = auth.approve_password_change(r["id"])
                 if ok:
                     st.success(f"Password updated for {r['username']}.")
-                    st.rerun()
+                    dirty = True
             if c3.button("Deny", key=f"denypw_{r['id']}"):
                 auth.deny_password_change(r["id"])
                 st.warning(f"Password change denied for {r['username']}.")
-                st.rerun()
+                dirty = True
 
     st.markdown("---")
     st.subheader("All Users")
@@ -887,10 +1128,46 @@ if page == "Admin / Users":
             auth.set_user_role(u["id"], role_new)
             auth.set_user_active(u["id"], active_new)
             st.success(f"Updated {u['username']} → role={role_new}, active={active_new}")
-            st.rerun()
+            dirty = True
         c5.write(u["created_at"])
 
+    if dirty:
+        st.rerun()
+
 # -------------------- Settings / Import --------------------
+# Sheets are read with openpyxl in read-only (streaming) mode: reruns only
+# touch the header and preview rows, and the import keeps just the mapped
+# columns instead of materializing the whole sheet.
+def sheet_names(uploaded):
+    wb = openpyxl.load_workbook(uploaded, read_only=True, data_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+def read_sheet(uploaded, sheet, columns=None, limit=None):
+    """Return *sheet* as a DataFrame; only *columns* (header names) and at most *limit* rows."""
+    wb = openpyxl.load_workbook(uploaded, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header, seen = [], {}
+        for i, h in enumerate(next(rows, ())):
+            h = f"Unnamed: {i}" if h is None else str(h)
+            if h in seen:
+                seen[h] += 1
+                h = f"{h}.{seen[h]}"
+            else:
+                seen[h] = 0
+            header.append(h)
+        keep = [i for i, h in enumerate(header) if columns is None or h in columns]
+        data = {header[i]: [] for i in keep}
+        for row in itertools.islice(rows, limit):
+            for i in keep:
+                data[header[i]].append(row[i] if i < len(row) else None)
+        return pd.DataFrame(data)
+    finally:
+        wb.close()
+
 if page == "Settings / Import":
     st.title("⚙️ Settings / Import")
     st.caption("Import products & inventory from Excel with column mapping; download DB.")
@@ -898,15 +1175,14 @@ if page == "Settings / Import":
     uploaded = st.file_uploader("Upload Excel (.xlsx)", type=["xlsx"])
     if uploaded is not None:
         try:
-            xls = pd.ExcelFile(uploaded)
-            sheet = st.selectbox("Select sheet", xls.sheet_names)
-            df_raw = xls.parse(sheet)
+            sheet = st.selectbox("Select sheet", sheet_names(uploaded))
+            preview = read_sheet(uploaded, sheet, limit=50)
 
             st.write("**Preview (first 50 rows):**")
-            st.dataframe(df_raw.head(50), use_container_width=True)
+            st.dataframe(preview, use_container_width=True)
 
             st.write("#### Map Columns")
-            cols = df_raw.columns.tolist()
+            cols = preview.columns.tolist()
 
             def pick(label):
                 return st.selectbox(label, [None] + cols)
@@ -927,88 +1203,99 @@ if page == "Settings / Import":
             clear_all = st.checkbox("Danger: Clear ALL products & inventory first", value=False)
 
             if st.button("Run Import"):
-                with db.get_conn() as conn:
-                    cur = conn.cursor()
+                ins = 0
+                upd = 0
+
+                # Clean and type every mapped column once, vectorized, then
+                # drop rows without a name or code.
+                fields = {
+                    "name": map_name, "code": map_code, "notes": map_notes,
+                    "price": map_price, "disc": map_disc, "cost": map_cost, "tax": map_tax,
+                    "other": map_other, "avail": map_avail, "low": map_low,
+                }
+                df_raw = read_sheet(uploaded, sheet, columns={c for c in fields.values() if c})
+                df = pd.DataFrame({f: (df_raw[c] if c else None) for f, c in fields.items()}, index=df_raw.index)
+                for col in ("name", "code"):
+                    df[col] = df[col].fillna("").astype(str).str.strip()
+                df["notes"] = df["notes"].fillna("").astype(str)
+                num_cols = ["price", "disc", "cost", "tax", "other", "avail", "low"]
+                df[num_cols] = df[num_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+                df["avail"] = df["avail"].astype("int64")
+                df["low"] = df["low"].astype("int64")
+                df = df[(df["name"] != "") & (df["code"] != "")]
+
+                if recalc:
+                    df["total_cost"], df["est_profit"], df["margin"] = compute_profit_metrics_vec(
+                        df["cost"], df["tax"], df["other"], df["price"]
+                    )
+                else:
+                    df["total_cost"], df["est_profit"], df["margin"] = profit_metrics(
+                        df["cost"], df["tax"], df["other"], df["price"]
+                    )
 
+                df["inv_val"] = np.maximum(df["avail"].to_numpy(), 0) * df["price"].to_numpy()
+                df["status"] = np.where(df["avail"].to_numpy() > 0, "In Stock", "Out of Stock")
+
+                # One IMMEDIATE transaction: optional wipe, prefetch of the
+                # code/inventory lookups, planning, then one executemany per
+                # statement. A failure anywhere leaves the DB untouched.
+                with db.transaction(immediate=True) as conn:
+                    cur = conn.cursor()
                     if clear_all:
                         cur.execute("DELETE FROM stock_in_logs")
                         cur.execute("DELETE FROM inventory")
                         cur.execute("DELETE FROM products")
-                        conn.commit()
-
-                    ins = 0
-                    upd = 0
-
-                    for _, r in df_raw.iterrows():
-                        name = str(r.get(map_name, "") or "").strip() if map_name else ""
-                        code = str(r.get(map_code, "") or "").strip() if map_code else ""
-                        if not name or not code:
-                            continue
-
-                        price = float(r.get(map_price, 0) or 0) if map_price else 0.0
-                        disc = float(r.get(map_disc, 0) or 0) if map_disc else 0.0
-                        cost = float(r.get(map_cost, 0) or 0) if map_cost else 0.0
-                        tax = float(r.get(map_tax, 0) or 0) if map_tax else 0.0
-                        other = float(r.get(map_other, 0) or 0) if map_other else 0.0
-                        avail = int(float(r.get(map_avail, 0) or 0)) if map_avail else 0
-                        low = int(float(r.get(map_low, 0) or 0)) if map_low else 0
-                        notes = str(r.get(map_notes, "") or "") if map_notes else ""
-
-                        if recalc:
-                            m = compute_profit_metrics(cost, tax, other, price)
-                            total_cost = m["total_cost"]
-                            est_profit = m["est_profit"]
-                            margin = m["profit_margin"]
-                        else:
-                            total_cost = cost + tax + other
-                            est_profit = price - total_cost
-                            margin = (est_profit / price) if price else 0.0
-
-                        existing = cur.execute("SELECT id FROM products WHERE item_code=?", (code,)).fetchone()
-                        if existing and upsert:
-                            pid = existing["id"]
-                            cur.execute(
-                                """
-                                UPDATE products SET
-                                  name=?, discount=?, item_cost=?, tax_amount=?, other_costs=?,
-                                  total_cost=?, selling_price=?, est_profit=?, profit_margin=?, notes=?
-                                WHERE id=?
-                                """,
-                                (name, disc, cost, tax, other, total_cost, price, est_profit, margin, notes, pid),
-                            )
+
+                    existing = {r["item_code"]: r["id"] for r in cur.execute(SQL_IMPORT_CODE_MAP)}
+                    has_inv = {r["product_id"] for r in cur.execute(SQL_IMPORT_INV_PIDS)}
+                    insert_products, update_products = [], []
+                    insert_inv, seed_inv, update_inv = {}, [], []
+                    pending = {}  # item_code -> position in insert_products
+
+                    # Column lists (.tolist() gives plain Python scalars sqlite3 can bind)
+                    # zipped into row tuples: no per-row Series allocation.
+                    plan_cols = ["name", "code", "notes", "price", "disc", "cost", "tax", "other",
+                                 "avail", "low", "total_cost", "est_profit", "margin", "inv_val", "status"]
+                    for (name, code, notes, price, disc, cost, tax, other,
+                         avail, low, total_cost, est_profit, margin, inv_val, status) in zip(*(df[c].tolist() for c in plan_cols)):
+                        if code in pending and upsert:
+                            # Repeated code in the file: the later row wins, as an update would.
+                            insert_products[pending[code]] = (name, code, disc, cost, tax, other, total_cost, price, est_profit, margin, notes)
+                            first_in = insert_inv[code][4]
+                            insert_inv[code] = (avail, low, status, inv_val, first_in)
+                            upd += 1
+                        elif code in existing and upsert:
+                            pid = existing[code]
+                            update_products.append((name, disc, cost, tax, other, total_cost, price, est_profit, margin, notes, pid))
+                            if pid in has_inv:
+                                update_inv.append((avail, low, status, inv_val, pid))
+                            else:
+                                has_inv.add(pid)
+                                seed_inv.append((pid, avail, low, status, inv_val, avail))
                             upd += 1
                         else:
-                            cur.execute(
-                                """
-                                INSERT INTO products (name, item_code, discount, item_cost, tax_amount, other_costs,
-                                                      total_cost, selling_price, est_profit, profit_margin, notes)
-                                VALUES (?,?,?,?,?,?,?,?,?,?,?)
-                                """,
-                                (name, code, disc, cost, tax, other, total_cost, price, est_profit, margin, notes),
-                            )
-                            pid = cur.lastrowid
+                            pending[code] = len(insert_products)
+                            insert_products.append((name, code, disc, cost, tax, other, total_cost, price, est_profit, margin, notes))
+                            insert_inv[code] = (avail, low, status, inv_val, avail)
                             ins += 1
 
-                        inv = cur.execute("SELECT * FROM inventory WHERE product_id=?", (pid,)).fetchone()
-                        inv_val = max(avail, 0) * price
-                        status = "In Stock" if avail > 0 else "Out of Stock"
-                        if inv:
-                            cur.execute(
-                                "UPDATE inventory SET available_stock=?, low_stock_alert=?, status=?, current_inventory_value=? WHERE product_id=?",
-                                (avail, low, status, inv_val, pid),
-                            )
-                        else:
-                            cur.execute(
-                                """
-                                INSERT INTO inventory (product_id, available_stock, low_stock_alert, status,
-                                                       current_inventory_value, all_time_stock_in, all_time_stock_out, all_time_sales)
-                                VALUES (?,?,?,?,?,?,?,?)
-                                """,
-                                (pid, avail, low, status, inv_val, avail, 0, 0.0),
-                            )
-
-                    conn.commit()
+                    cur.executemany(SQL_IMPORT_INSERT_PRODUCT, insert_products)
+                    cur.executemany(SQL_IMPORT_UPDATE_PRODUCT, update_products)
+                    if insert_products:
+                        existing = {r["item_code"]: r["id"] for r in cur.execute(SQL_IMPORT_CODE_MAP)}
+                        seed_inv += [(existing[code], *vals) for code, vals in insert_inv.items()]
+                    cur.executemany(SQL_IMPORT_INSERT_INV, seed_inv)
+                    cur.executemany(SQL_IMPORT_UPDATE_INV, update_inv)
+                    # Opening stock of each new inventory row is logged, so the
+                    # stock-in history accounts for its all_time_stock_in.
+                    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    cur.executemany(
+                        SQL_INSERT_STOCK_IN,
+                        [(ts, pid, first_in, "Import Seed", "") for pid, *_, first_in in seed_inv if first_in > 0],
+                    )
+
                 st.success(f"Import complete. Inserted: {ins}, Updated: {upd}")
+                clear_caches()
                 st.rerun()
 
         except Exception as e:
@@ -1017,6 +1304,7 @@ if page == "Settings / Import":
     st.markdown("---")
     st.caption("Database download / reset")
     if os.path.exists(DB_FILE):
+        db.checkpoint()
         with open(DB_FILE, "rb") as f:
             st.download_button(
                 "Download Database (SQLite)",
@@ -1031,39 +1319,62 @@ if page == "Settings / Import":
         from modules import gdrive, sync
         folder_id = st.secrets["gdrive"]["folder_id"]
 
+        @st.cache_data(ttl=30, show_spinner=False)
+        def _drive_files(folder_id: str):
+            return gdrive.list_files(folder_id)
+
         st.markdown("## ☁️ Google Drive Backup / Restore")
         c1, c2 = st.columns(2)
         with c1:
             if st.button("Backup SQLite DB → Google Drive"):
                 try:
-                    fid = gdrive.upload_file(DB_FILE, folder_id)
-                    st.success(f"DB uploaded to Drive (file id: {fid})")
+                    # Upload a point-in-time snapshot in the background so the
+                    # page stays usable and later writes can't tear the copy.
+                    snap_dir = tempfile.mkdtemp(prefix="takeout-backup-")
+                    snap = db.snapshot(os.path.join(snap_dir, os.path.basename(DB_FILE)))
+
+                    def upload_snapshot():
+                        try:
+                            return gdrive.upload_file(snap, folder_id)
+                        finally:
+                            shutil.rmtree(snap_dir, ignore_errors=True)
+
+                    fut = uploader().submit(upload_snapshot)
+                    st.session_state.setdefault("uploads", []).append(("DB backup", fut))
+                    st.info("Backup started; uploading to Drive in the background.")
                 except Exception as e:
                     st.error(f"Backup failed: {e}")
 
         with c2:
             st.caption("List files in Drive folder")
+            if st.button("Refresh", key="drive_refresh"):
+                _drive_files.clear()
             try:
-                files = gdrive.list_files(folder_id)
+                files = _drive_files(folder_id)
                 st.dataframe(pd.DataFrame(files), use_container_width=True)
             except Exception as e:
+                files = None
                 st.error(f"List failed: {e}")
 
         st.markdown("### Restore DB from Drive")
         try:
-            files = gdrive.list_files(folder_id)
+            if files is None:
+                files = _drive_files(folder_id)
             db_candidates = [f for f in files if f["name"].endswith(".db")]
             labels = [f'{f["name"]}  ({f["id"]})' for f in db_candidates]
             restore_label = st.selectbox("Pick a .db file from Drive to restore", options=(labels or ["— none —"]))
             if labels and st.button("Restore selected DB"):
                 chosen = db_candidates[labels.index(restore_label)]
-                tmp_path = os.path.join("tmp_restore.db")
+                tmp_path = DB_FILE + ".restore.tmp"  # same filesystem, so os.replace is a rename
                 gdrive.download_file(chosen["id"], tmp_path)
                 backup_local = DB_FILE + ".pre-restore.bak"
                 try:
-                    if os.path.exists(DB_FILE):
-                        os.replace(DB_FILE, backup_local)
-                    os.replace(tmp_path, DB_FILE)
+                    with db.swapping():
+                        if os.path.exists(DB_FILE):
+                            os.replace(DB_FILE, backup_local)
+                        os.replace(tmp_path, DB_FILE)
+                    clear_caches()
+                    _bootstrap.clear()
                     st.success("Restore complete. Please restart the app.")
                 except Exception as e:
                     st.error(f"Restore failed: {e}")
@@ -1073,10 +1384,31 @@ if page == "Settings / Import":
         st.markdown("## 🔄 Database Sync with Google Drive")
         if st.button("Sync now (newest wins)"):
             try:
+                db.checkpoint()
                 res = sync.newest_wins_sync(DB_FILE, folder_id)
                 st.success(f"Sync: {res['action']} {('— ' + res.get('why','')) if res.get('why') else ''}")
+                clear_caches()
+                if res.get("action") == "download":
+                    _bootstrap.clear()
                 st.rerun()
             except Exception as e:
                 st.error(f"Sync failed: {e}")
     else:
         st.info("Google Drive not configured. Add `.streamlit/secrets.toml` to enable Drive features.")
+
+# -------------------- Background Drive uploads --------------------
+# Finished uploads are reported once, on this full run, and then forgotten;
+# the polling status fragment is only rendered while some are still pending.
+finished_uploads, pending_uploads = [], []
+for label, fut in st.session_state.get("uploads", []):
+    (finished_uploads if fut.done() else pending_uploads).append((label, fut))
+st.session_state["uploads"] = pending_uploads
+if finished_uploads or pending_uploads:
+    with st.sidebar:
+        for label, fut in finished_uploads:
+            if fut.exception():
+                st.warning(f"Drive upload of {label} failed: {fut.exception()}")
+            else:
+                st.caption(f"✅ {label} uploaded to Drive (file id: {fut.result()})")
+        if pending_uploads:
+            upload_status()
@@ -1,39 +1,75 @@
 import os, hashlib, secrets
 from datetime import datetime
+
+import streamlit as st
+
 from . import db
 
 ROLE_LEVEL = {"guest": 0, "viewer": 1, "user": 2, "admin": 3}
 
+# Hashes are stored as "pbkdf2_sha256$<iterations>$<hex>"; bare 64-char hex
+# values are legacy single-round sha256(salt + password) and are upgraded on
+# the next successful login.
+PBKDF2_PREFIX = "pbkdf2_sha256"
+PBKDF2_ITERATIONS = 200_000
+
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations).hex()
+
 def hash_password(password: str, salt: str | None = None):
     if salt is None:
         salt = secrets.token_hex(16)
-    h = hashlib.sha256((salt + password).encode("utf-8")).hexdigest()
+    h = f"{PBKDF2_PREFIX}${PBKDF2_ITERATIONS}${_pbkdf2(password, salt, PBKDF2_ITERATIONS)}"
     return h, salt
 
 def verify_password(password: str, pw_hash: str, pw_salt: str) -> bool:
-    calc, _ = hash_password(password, pw_salt)
-    return secrets.compare_digest(calc, pw_hash)
+    if pw_hash.startswith(PBKDF2_PREFIX + "$"):
+        _, iterations, digest = pw_hash.split("$", 2)
+        calc = _pbkdf2(password, pw_salt, int(iterations))
+    else:
+        digest = pw_hash
+        calc = hashlib.sha256((pw_salt + password).encode("utf-8")).hexdigest()
+    return secrets.compare_digest(calc, digest)
+
+def needs_rehash(pw_hash: str) -> bool:
+    return not pw_hash.startswith(f"{PBKDF2_PREFIX}${PBKDF2_ITERATIONS}$")
+
+def upgrade_password(username: str, password: str):
+    pw_hash, pw_salt = hash_password(password)
+    with db.transaction() as conn:
+        conn.execute("UPDATE users SET pw_hash=?, pw_salt=? WHERE username=?", (pw_hash, pw_salt, username))
 
 # --- User CRUD helpers ---
+# The admin lists are cached per version; every mutator bumps the versions
+# of the lists it changes so the next render re-reads only those.
+_ver = {"users": 0, "pending": 0, "pwreqs": 0}
+
+def _bump(*keys):
+    for k in keys:
+        _ver[k] += 1
+
+@st.cache_data(ttl=30, max_entries=4)
+def _fetch_all(sql: str, ver: int):
+    return [dict(r) for r in db.get_conn().execute(sql).fetchall()]
+
 def get_user(username: str):
-    with db.get_conn() as conn:
-        return conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+    return db.get_conn().execute("SELECT username, pw_hash, pw_salt, role, is_active FROM users WHERE username=?", (username,)).fetchone()
 
 def register_request(username: str, password: str, requested_role: str = "viewer"):
     pw_hash, pw_salt = hash_password(password)
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute(
             "INSERT INTO pending_users (username, pw_hash, pw_salt, requested_role, created_at) VALUES (?,?,?,?,?)",
             (username, pw_hash, pw_salt, requested_role, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
         )
+    _bump("pending")
 
 def list_pending_users():
-    with db.get_conn() as conn:
-        return conn.execute("SELECT * FROM pending_users ORDER BY created_at ASC").fetchall()
+    return _fetch_all("SELECT id, username, requested_role, created_at FROM pending_users ORDER BY created_at ASC", _ver["pending"])
 
 def approve_user(pending_id: int, role: str = "viewer"):
-    with db.get_conn() as conn:
-        p = conn.execute("SELECT * FROM pending_users WHERE id=?", (pending_id,)).fetchone()
+    with db.transaction() as conn:
+        p = conn.execute("SELECT username, pw_hash, pw_salt FROM pending_users WHERE id=?", (pending_id,)).fetchone()
         if not p:
             return False
         # create user
@@ -42,47 +78,52 @@ def approve_user(pending_id: int, role: str = "viewer"):
             (p["username"], p["pw_hash"], p["pw_salt"], role, 1, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
         )
         conn.execute("DELETE FROM pending_users WHERE id=?", (pending_id,))
-        return True
+    _bump("pending", "users")
+    return True
 
 def deny_user(pending_id: int):
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute("DELETE FROM pending_users WHERE id=?", (pending_id,))
+    _bump("pending")
 
 def list_users():
-    with db.get_conn() as conn:
-        return conn.execute("SELECT id, username, role, is_active, created_at FROM users ORDER BY role DESC, username").fetchall()
+    return _fetch_all("SELECT id, username, role, is_active, created_at FROM users ORDER BY role DESC, username", _ver["users"])
 
 def set_user_role(user_id: int, role: str):
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute("UPDATE users SET role=? WHERE id=?", (role, user_id))
+    _bump("users")
 
 def set_user_active(user_id: int, active: bool):
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute("UPDATE users SET is_active=? WHERE id=?", (1 if active else 0, user_id))
+    _bump("users")
 
 # --- Password change (requires admin approval) ---
 def request_password_change(username: str, new_password: str):
     new_hash, new_salt = hash_password(new_password)
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute(
             "INSERT INTO password_change_requests (username, new_pw_hash, new_pw_salt, status, created_at) VALUES (?,?,?,?,?)",
             (username, new_hash, new_salt, "pending", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
         )
+    _bump("pwreqs")
 
 def list_password_requests():
-    with db.get_conn() as conn:
-        return conn.execute("SELECT * FROM password_change_requests WHERE status='pending' ORDER BY created_at").fetchall()
+    return _fetch_all("SELECT id, username, created_at FROM password_change_requests WHERE status='pending' ORDER BY created_at", _ver["pwreqs"])
 
 def approve_password_change(req_id: int):
-    with db.get_conn() as conn:
-        r = conn.execute("SELECT * FROM password_change_requests WHERE id=? AND status='pending'", (req_id,)).fetchone()
+    with db.transaction() as conn:
+        r = conn.execute("SELECT username, new_pw_hash, new_pw_salt FROM password_change_requests WHERE id=? AND status='pending'", (req_id,)).fetchone()
         if not r:
             return False
         # apply
         conn.execute("UPDATE users SET pw_hash=?, pw_salt=? WHERE username=?", (r["new_pw_hash"], r["new_pw_salt"], r["username"]))
         conn.execute("UPDATE password_change_requests SET status='approved', decided_at=? WHERE id=?", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), req_id))
-        return True
+    _bump("pwreqs")
+    return True
 
 def deny_password_change(req_id: int):
-    with db.get_conn() as conn:
+    with db.transaction() as conn:
         conn.execute("UPDATE password_change_requests SET status='denied', decided_at=? WHERE id=?", (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), req_id))
+    _bump("pwreqs")
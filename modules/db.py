@@ -1,187 +1,392 @@
+import atexit
+import itertools
 import os
 import sqlite3
-from contextlib import closing
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+
+import streamlit as st
+
 from .auth import hash_password  # NEW
 
 DB_PATH = os.environ.get("TAKEOUT_DB_PATH", "takeout.db")
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+_wal_ready = False
+
+def connect(check_same_thread: bool = True):
+    conn = sqlite3.connect(
+        DB_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+        check_same_thread=check_same_thread,
+        cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
+    global _wal_ready
+    if not _wal_ready:
+        # WAL lets readers from other sessions proceed while one writer commits.
+        # The mode is stored in the DB file, so it only needs setting once per
+        # file (close_all() re-arms this when the file is swapped).
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_ready = True
+    # Per-connection settings. foreign_keys stays at SQLite's default (off):
+    # the schema's ON DELETE CASCADE would otherwise wipe sales history when
+    # products are cleared on import.
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
+@st.cache_resource
+def shared_conn():
+    """The writer: one connection per process, reused across reruns and sessions.
+
+    Only ``transaction()`` (and the maintenance helpers below) use it, under
+    ``_write_lock``; reads go through ``get_conn()``. Never closed by callers.
+    """
+    global _live_conn
+    _live_conn = connect(check_same_thread=False)
+    return _live_conn
+
+# The connection shared_conn() handed out, if any; lets the exit hook tidy up
+# without opening a connection just to close it.
+_live_conn = None
+
+def optimize():
+    """Refresh planner statistics where they've drifted (cheap, incremental)."""
+    with _write_lock:
+        shared_conn().execute("PRAGMA optimize")
+
+@atexit.register
+def _optimize_at_exit():
+    if _live_conn is not None:
+        try:
+            _live_conn.execute("PRAGMA optimize")
+            _live_conn.close()
+        except sqlite3.Error:
+            pass
+
+# Readers get their own connection per thread. Under WAL each one sees only
+# committed data, never a writer's still-open transaction on shared_conn().
+# close_all() bumps the generation instead of closing other threads' readers
+# under them; each reader reopens on its next get_conn().
+_readers = threading.local()
+_generation = 0
+
+def get_conn():
+    """This thread's read connection (opened on first use); callers never close it.
+
+    Writes go through ``transaction()``.
+    """
+    conn = getattr(_readers, "conn", None)
+    if conn is None or _readers.generation != _generation:
+        # First use, or the file was swapped since: (re)open, waiting out any
+        # swap still in progress (swapping() holds the lock).
+        with _write_lock:
+            if conn is not None:
+                conn.close()
+            conn = _readers.conn = connect()
+            _readers.generation = _generation
+    return conn
+
+# Writers share one connection, and with it one transaction: they take this
+# lock so one session's commit never flushes another's half-done work.
+_write_lock = threading.RLock()
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """Serialize a write block on the shared connection; commit or roll back on exit.
+
+    ``immediate=True`` takes SQLite's write lock up front (BEGIN IMMEDIATE), so
+    reads inside the block see the same snapshot the writes land on.
+    """
+    conn = shared_conn()
+    with _write_lock, conn:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+
+def checkpoint():
+    """Fold the WAL into the main DB file so it can be copied/uploaded as-is.
+
+    Uses the shared connection if one is open; otherwise a short-lived one
+    that is closed again, so no handle is left on the file (Drive sync may
+    swap it next).
+    """
+    if not os.path.exists(DB_PATH):
+        return
+    with _write_lock:
+        if _live_conn is not None:
+            _live_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+
+def snapshot(dest_path: str):
+    """Write a consistent copy of the live DB to *dest_path* (SQLite online backup)."""
+    dest = sqlite3.connect(dest_path)
+    try:
+        with _write_lock:
+            shared_conn().backup(dest)
+    finally:
+        dest.close()
+    return dest_path
+
+def close_all():
+    """Checkpoint and close the app's connections before the DB file is swapped.
+
+    Holds the write lock throughout, so no session's transaction is cut off
+    mid-way. Other threads' readers are not closed under them: bumping the
+    generation makes each one reopen on its next get_conn(). Use swapping()
+    to keep them off the file until the swap is done.
+    """
+    global _wal_ready, _live_conn, _generation
+    with _write_lock:
+        if _live_conn is not None:
+            try:
+                _live_conn.execute("PRAGMA optimize")
+                _live_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                _live_conn.close()
+        shared_conn.clear()
+        _wal_ready = False
+        _live_conn = None
+        _generation += 1
+        reader = getattr(_readers, "conn", None)
+        if reader is not None:
+            reader.close()
+            _readers.conn = None
+
+@contextmanager
+def swapping():
+    """close_all(), then hold writers and (re)opening readers off the DB file
+    until the block exits; replace the file inside it."""
+    with _write_lock:
+        close_all()
+        yield
+
+# Column orders used by the form/import insert paths (see bulk_insert).
+PRODUCT_COLS = (
+    "name", "item_code", "discount", "item_cost", "tax_amount", "other_costs",
+    "total_cost", "selling_price", "est_profit", "profit_margin", "notes",
+)
+EXPENSE_COLS = (
+    "purchase_date", "category", "description", "total_cost", "status",
+    "receipt_no", "vendor_name", "vendor_tin", "business_address", "notes",
+)
+SUPPLY_COLS = (
+    "item_description", "supplier", "units_per_piece", "unit_symbol", "item_cost", "last_updated",
+    "available_stocks", "low_stock_alert", "status", "inventory_value", "notes",
+)
+
+def bulk_insert(table, cols, rows, chunk: int = 1000):
+    """Insert *rows* (iterable of tuples ordered like *cols*) with executemany.
+
+    A single row is just ``[row]``. Rows are written in BEGIN IMMEDIATE
+    transactions of up to *chunk* rows each, so a large ingest pays one commit
+    per chunk instead of one per row and the WAL stays bounded. Returns the
+    number of inserted rows.
+    """
+    sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({','.join('?' * len(cols))})"
+    rows = iter(rows)
+    total = 0
+    while True:
+        # executemany pulls rows straight from the iterator (no per-chunk list);
+        # the statement is prepared once and reused from the statement cache.
+        with transaction(immediate=True) as conn:
+            n = conn.executemany(sql, itertools.islice(rows, chunk)).rowcount
+        total += n
+        if n < chunk:
+            return total
+
+# Whole schema (tables and indexes) in one script: one executescript() call
+# instead of a prepare/execute round trip per statement. Connection pragmas
+# live in connect(); journal_mode can't be changed inside this transaction.
+SCHEMA_SQL = """
+BEGIN;
+    -- Core tables
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_code TEXT UNIQUE,
+        name TEXT NOT NULL,
+        discount REAL DEFAULT 0.0,
+        item_cost REAL DEFAULT 0.0,
+        tax_amount REAL DEFAULT 0.0,
+        other_costs REAL DEFAULT 0.0,
+        total_cost REAL DEFAULT 0.0,
+        selling_price REAL DEFAULT 0.0,
+        est_profit REAL DEFAULT 0.0,
+        profit_margin REAL DEFAULT 0.0,
+        all_time_sold INTEGER DEFAULT 0,
+        all_time_sales REAL DEFAULT 0.0,
+        status TEXT DEFAULT 'Active',
+        notes TEXT DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS inventory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        available_stock INTEGER DEFAULT 0,
+        low_stock_alert INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'In Stock',
+        current_inventory_value REAL DEFAULT 0.0,
+        all_time_stock_in INTEGER DEFAULT 0,
+        all_time_stock_out INTEGER DEFAULT 0,
+        all_time_sales REAL DEFAULT 0.0,
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    CREATE TABLE IF NOT EXISTS stock_in_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_in_ts TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        stocks_added INTEGER NOT NULL,
+        status TEXT DEFAULT 'Stock In',
+        notes TEXT DEFAULT '',
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        billing_date TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        item_price REAL NOT NULL,
+        discount REAL DEFAULT 0.0,
+        total_amount REAL NOT NULL,
+        payment_status TEXT DEFAULT 'Unpaid',
+        sales_channel TEXT DEFAULT 'Walk-in',
+        customer_name TEXT DEFAULT '',
+        customer_tin TEXT DEFAULT '',
+        business_address TEXT DEFAULT '',
+        notes TEXT DEFAULT '',
+        vat_inclusive INTEGER DEFAULT 1,
+        vat_amount REAL DEFAULT 0.0,
+        net_of_vat REAL DEFAULT 0.0,
+        invoice_no TEXT DEFAULT NULL,
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        purchase_date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT NOT NULL,
+        total_cost REAL NOT NULL,
+        status TEXT DEFAULT 'Posted',
+        receipt_no TEXT DEFAULT '',
+        vendor_name TEXT DEFAULT '',
+        vendor_tin TEXT DEFAULT '',
+        business_address TEXT DEFAULT '',
+        notes TEXT DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS supplies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        item_description TEXT NOT NULL,
+        supplier TEXT DEFAULT '',
+        units_per_piece REAL DEFAULT 1.0,
+        unit_symbol TEXT DEFAULT '',
+        item_cost REAL DEFAULT 0.0,
+        last_updated TEXT DEFAULT '',
+        available_stocks REAL DEFAULT 0.0,
+        low_stock_alert REAL DEFAULT 0.0,
+        status TEXT DEFAULT 'In Stock',
+        inventory_value REAL DEFAULT 0.0,
+        notes TEXT DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS targets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        period TEXT NOT NULL,
+        sales_target REAL DEFAULT 0.0,
+        expense_target REAL DEFAULT 0.0,
+        profit_target REAL DEFAULT 0.0,
+        notes TEXT DEFAULT ''
+    );
+    CREATE TABLE IF NOT EXISTS shareholders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        ownership_pct REAL NOT NULL CHECK(ownership_pct >= 0 AND ownership_pct <= 100),
+        notes TEXT DEFAULT ''
+    );
+
+    -- Authentication tables
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        pw_hash TEXT NOT NULL,
+        pw_salt TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'viewer', -- guest | viewer | user | admin
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS pending_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        pw_hash TEXT NOT NULL,
+        pw_salt TEXT NOT NULL,
+        requested_role TEXT NOT NULL DEFAULT 'viewer',
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS password_change_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        new_pw_hash TEXT NOT NULL,
+        new_pw_salt TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending', -- pending | approved | denied
+        created_at TEXT NOT NULL,
+        decided_at TEXT
+    );
+
+    -- Indexes for the hot ORDER BY / GROUP BY / JOIN paths
+    CREATE INDEX IF NOT EXISTS ix_sales_bd ON sales(billing_date DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS ix_sales_pid_date ON sales(product_id, billing_date);
+    CREATE INDEX IF NOT EXISTS ix_sales_day ON sales(substr(billing_date,1,10));
+    CREATE INDEX IF NOT EXISTS ix_sales_month ON sales(substr(billing_date,1,7));
+    CREATE INDEX IF NOT EXISTS ix_expenses_pd ON expenses(purchase_date DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS ix_expenses_day ON expenses(substr(purchase_date,1,10));
+    CREATE INDEX IF NOT EXISTS ix_expenses_month ON expenses(substr(purchase_date,1,7));
+    CREATE INDEX IF NOT EXISTS ix_expenses_year ON expenses(substr(purchase_date,1,4));
+    CREATE INDEX IF NOT EXISTS ix_inventory_pid ON inventory(product_id);
+    CREATE INDEX IF NOT EXISTS ix_stockin_ts_id ON stock_in_logs(stock_in_ts DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS ix_stockin_pid_ts ON stock_in_logs(product_id, stock_in_ts);
+    CREATE INDEX IF NOT EXISTS ix_pwreq_status ON password_change_requests(status, created_at);
+
+    -- Retired indexes. IF NOT EXISTS never rebuilds an index whose definition
+    -- changed, so a redefined one gets a new name and the old name is dropped.
+    DROP INDEX IF EXISTS ix_stockin_ts;  -- (stock_in_ts DESC); now ix_stockin_ts_id
+COMMIT;
+"""
+
 def init_db():
-    with closing(get_conn()) as conn, conn:
+    with transaction() as conn:
+        conn.executescript(SCHEMA_SQL)
         cur = conn.cursor()
-
-        # --- Core tables (existing) ---
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                item_code TEXT UNIQUE,
-                name TEXT NOT NULL,
-                discount REAL DEFAULT 0.0,
-                item_cost REAL DEFAULT 0.0,
-                tax_amount REAL DEFAULT 0.0,
-                other_costs REAL DEFAULT 0.0,
-                total_cost REAL DEFAULT 0.0,
-                selling_price REAL DEFAULT 0.0,
-                est_profit REAL DEFAULT 0.0,
-                profit_margin REAL DEFAULT 0.0,
-                all_time_sold INTEGER DEFAULT 0,
-                all_time_sales REAL DEFAULT 0.0,
-                status TEXT DEFAULT 'Active',
-                notes TEXT DEFAULT ''
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL,
-                available_stock INTEGER DEFAULT 0,
-                low_stock_alert INTEGER DEFAULT 0,
-                status TEXT DEFAULT 'In Stock',
-                current_inventory_value REAL DEFAULT 0.0,
-                all_time_stock_in INTEGER DEFAULT 0,
-                all_time_stock_out INTEGER DEFAULT 0,
-                all_time_sales REAL DEFAULT 0.0,
-                FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS stock_in_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                stock_in_ts TEXT NOT NULL,
-                product_id INTEGER NOT NULL,
-                stocks_added INTEGER NOT NULL,
-                status TEXT DEFAULT 'Stock In',
-                notes TEXT DEFAULT '',
-                FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                billing_date TEXT NOT NULL,
-                product_id INTEGER NOT NULL,
-                quantity INTEGER NOT NULL,
-                item_price REAL NOT NULL,
-                discount REAL DEFAULT 0.0,
-                total_amount REAL NOT NULL,
-                payment_status TEXT DEFAULT 'Unpaid',
-                sales_channel TEXT DEFAULT 'Walk-in',
-                customer_name TEXT DEFAULT '',
-                customer_tin TEXT DEFAULT '',
-                business_address TEXT DEFAULT '',
-                notes TEXT DEFAULT '',
-                vat_inclusive INTEGER DEFAULT 1,
-                vat_amount REAL DEFAULT 0.0,
-                net_of_vat REAL DEFAULT 0.0,
-                invoice_no TEXT DEFAULT NULL,
-                FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                purchase_date TEXT NOT NULL,
-                category TEXT NOT NULL,
-                description TEXT NOT NULL,
-                total_cost REAL NOT NULL,
-                status TEXT DEFAULT 'Posted',
-                receipt_no TEXT DEFAULT '',
-                vendor_name TEXT DEFAULT '',
-                vendor_tin TEXT DEFAULT '',
-                business_address TEXT DEFAULT '',
-                notes TEXT DEFAULT ''
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS supplies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                item_description TEXT NOT NULL,
-                supplier TEXT DEFAULT '',
-                units_per_piece REAL DEFAULT 1.0,
-                unit_symbol TEXT DEFAULT '',
-                item_cost REAL DEFAULT 0.0,
-                last_updated TEXT DEFAULT '',
-                available_stocks REAL DEFAULT 0.0,
-                low_stock_alert REAL DEFAULT 0.0,
-                status TEXT DEFAULT 'In Stock',
-                inventory_value REAL DEFAULT 0.0,
-                notes TEXT DEFAULT ''
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS targets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                period TEXT NOT NULL,
-                sales_target REAL DEFAULT 0.0,
-                expense_target REAL DEFAULT 0.0,
-                profit_target REAL DEFAULT 0.0,
-                notes TEXT DEFAULT ''
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS shareholders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                ownership_pct REAL NOT NULL CHECK(ownership_pct >= 0 AND ownership_pct <= 100),
-                notes TEXT DEFAULT ''
-            )
-        """)
-
-        # --- NEW: Authentication tables ---
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                pw_hash TEXT NOT NULL,
-                pw_salt TEXT NOT NULL,
-                role TEXT NOT NULL DEFAULT 'viewer', -- guest | viewer | user | admin
-                is_active INTEGER NOT NULL DEFAULT 1,
-                created_at TEXT NOT NULL
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS pending_users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                pw_hash TEXT NOT NULL,
-                pw_salt TEXT NOT NULL,
-                requested_role TEXT NOT NULL DEFAULT 'viewer',
-                created_at TEXT NOT NULL
-            )
-        """)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS password_change_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                new_pw_hash TEXT NOT NULL,
-                new_pw_salt TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending', -- pending | approved | denied
-                created_at TEXT NOT NULL,
-                decided_at TEXT
-            )
-        """)
+        # Give the planner statistics for the schema's indexes the first time
+        # round; later refreshes are incremental (PRAGMA optimize).
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone() is None:
+            cur.execute("ANALYZE")
 
     ensure_admin_user()
 
+SQL_REPAIR_ADMIN = "UPDATE users SET role='admin', is_active=1 WHERE username='admin'"
+SQL_UPSERT_ADMIN = """
+    INSERT INTO users (username, pw_hash, pw_salt, role, is_active, created_at)
+    VALUES ('admin', ?, ?, 'admin', 1, ?)
+    ON CONFLICT(username) DO UPDATE SET role='admin', is_active=1
+"""
+
 def ensure_admin_user():
     """Create/repair built-in admin (admin / 08201977)."""
-    with closing(get_conn()) as conn, conn:
-        cur = conn.cursor()
-        row = cur.execute("SELECT id, pw_hash, pw_salt, is_active FROM users WHERE username='admin'").fetchone()
-        if row is None:
-            pw_hash, pw_salt = hash_password("08201977")
-            cur.execute(
-                "INSERT INTO users (username, pw_hash, pw_salt, role, is_active, created_at) VALUES (?,?,?,?,?,?)",
-                ("admin", pw_hash, pw_salt, "admin", 1, now_str()),
-            )
-        else:
-            # ensure active & role
-            cur.execute("UPDATE users SET role='admin', is_active=1 WHERE username='admin'")
+    with transaction() as conn:
+        # Existing admin keeps its password; only role/active are repaired.
+        if conn.execute(SQL_REPAIR_ADMIN).rowcount:
+            return
+    # Missing: only now pay for the (deliberately slow) PBKDF2 hash, outside
+    # the write lock. The upsert covers another process creating it meanwhile.
+    pw_hash, pw_salt = hash_password("08201977")
+    with transaction() as conn:
+        conn.execute(SQL_UPSERT_ADMIN, (pw_hash, pw_salt, now_str()))
 
 def now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
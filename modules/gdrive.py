@@ -7,9 +7,13 @@
 #   google-auth-httplib2
 # ----------------------------------
 
+import hashlib
 import io
 import os
 import mimetypes
+import threading
+from datetime import datetime
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 
 import streamlit as st
@@ -23,6 +27,16 @@ SCOPES: List[str] = [
     "https://www.googleapis.com/auth/drive"
 ]
 
+# Uploads and downloads move the file in 8 MiB chunks: an interrupted chunk
+# is retried on its own, and only one chunk is ever held in memory.
+CHUNK_SIZE = 8 * 1024 * 1024
+# Retries (with the client's exponential backoff) per chunk request; larger
+# chunks make a dropped connection costlier, so absorb transient resets.
+NUM_RETRIES = 5
+# Below this size a single multipart request beats opening a resumable
+# session (one extra round trip) first.
+RESUMABLE_MIN_SIZE = 5 * 1024 * 1024
+
 
 # -------------------------------------------------------------------
 # Internals – imports that require optional packages.
@@ -63,9 +77,11 @@ def _google_deps() -> Tuple[
 # -------------------------------------------------------------------
 # Credentials & Service
 # -------------------------------------------------------------------
+@st.cache_resource(show_spinner=False)
 def _credentials() -> Any:
     """
     Build the service‑account credentials from Streamlit secrets.
+    Cached per process; the credentials object refreshes its own token.
 
     ``st.secrets["gdrive_service_account"]`` must contain a JSON object
     (the same you download from Google Cloud IAM / Service Accounts).
@@ -78,13 +94,46 @@ def _credentials() -> Any:
     return credentials
 
 
+# httplib2.Http is not thread-safe, so each thread (script run or background
+# worker) sends its requests over its own authorized connection; the service
+# object itself is built once per process and shared.
+_local = threading.local()
+
+
+def _thread_http() -> Any:
+    """
+    Return the authorized HTTP connection for the current thread.
+    """
+    http = getattr(_local, "http", None)
+    if http is None:
+        import google_auth_httplib2
+        import httplib2
+
+        http = google_auth_httplib2.AuthorizedHttp(_credentials(), http=httplib2.Http())
+        _local.http = http
+    return http
+
+
+def _thread_request(http: Any, *args: Any, **kwargs: Any) -> Any:
+    """
+    ``requestBuilder`` for the shared service: ignore its own *http* and
+    send every request over the calling thread's connection.
+    """
+    from googleapiclient.http import HttpRequest
+
+    return HttpRequest(_thread_http(), *args, **kwargs)
+
+
+@st.cache_resource(show_spinner=False)
 def _service() -> Any:
     """
-    Return the Drive v3 service object.
+    Return the Drive v3 service object, built once per process.
     """
     _, build, *_ = _google_deps()
     creds = _credentials()
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    return build(
+        "drive", "v3", credentials=creds, cache_discovery=False, requestBuilder=_thread_request
+    )
 
 
 # -------------------------------------------------------------------
@@ -107,6 +156,16 @@ def probe_folder(folder_id: str) -> Tuple[bool, Any]:
         return False, err
 
 
+def _add_epoch(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Parse each RFC 3339 ``modifiedTime`` once into a ``modifiedTimeEpoch`` float."""
+    for f in files:
+        mt = f.get("modifiedTime")
+        f["modifiedTimeEpoch"] = (
+            datetime.fromisoformat(mt.replace("Z", "+00:00")).timestamp() if mt else 0.0
+        )
+    return files
+
+
 def list_files(folder_id: str) -> List[Dict[str, Any]]:
     """
     Return a list of all non‑trashed files in *folder_id*, sorted by
@@ -125,7 +184,7 @@ def list_files(folder_id: str) -> List[Dict[str, Any]]:
             supportsAllDrives=True,
             includeItemsFromAllDrives=True,
         ).execute()
-        all_files.extend(resp.get("files", []))
+        all_files.extend(_add_epoch(resp.get("files", [])))
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
@@ -145,40 +204,83 @@ def get_file_meta(file_id: str) -> Dict[str, Any]:
     ).execute()
 
 
-def find_file_by_name(name: str, folder_id: str) -> Optional[Dict[str, Any]]:
+def _quote(value: str) -> str:
+    """Quote *value* as a Drive query string literal (backslash, then quote)."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+@lru_cache(maxsize=256)
+def _name_query(name: str, folder_id: str) -> str:
+    return f"name = {_quote(name)} and {_quote(folder_id)} in parents and trashed = false"
+
+
+def find_file_by_name(
+    name: str,
+    folder_id: str,
+    fields: str = "id, name, mimeType, size, modifiedTime, md5Checksum",
+) -> Optional[Dict[str, Any]]:
     """
-    Return the first file that matches *name* in the given folder,
-    or None if no match is found.
+    Return the newest file that matches *name* in the given folder,
+    or None if no match is found. *fields* narrows the returned metadata.
     """
     svc = _service()
-
-    # Escape single quotes in the name for the Drive query string.
-    escaped_name = name.replace("'", "\\'")
-    query = (
-        f"name = '{escaped_name}' "
-        f"and '{folder_id}' in parents "
-        "and trashed = false"
-    )
-
     res = svc.files().list(
-        q=query,
-        fields="files(id, name, mimeType, size, modifiedTime, md5Checksum)",
+        q=_name_query(name, folder_id),
+        fields=f"files({fields})",
+        orderBy="modifiedTime desc",
+        pageSize=1,
         supportsAllDrives=True,
         includeItemsFromAllDrives=True,
     ).execute()
 
-    files = res.get("files", [])
+    files = _add_epoch(res.get("files", []))
     return files[0] if files else None
 
 
+# Drive ids of files this process has looked up or created, keyed on
+# (name, folder_id). An id survives content updates, so only a deletion
+# (a 404 on use) invalidates one; misses are never cached.
+_file_ids: Dict[Tuple[str, str], str] = {}
+_file_ids_lock = threading.Lock()
+
+
+def _find_id(name: str, folder_id: str) -> Optional[str]:
+    """
+    Drive id of *name* in *folder_id*, or None. Memoized per process.
+    """
+    key = (name, folder_id)
+    with _file_ids_lock:
+        file_id = _file_ids.get(key)
+    if file_id is None:
+        found = find_file_by_name(name, folder_id, fields="id")
+        if found is None:
+            return None
+        file_id = found["id"]
+        with _file_ids_lock:
+            _file_ids[key] = file_id
+    return file_id
+
+
 # -------------------------------------------------------------------
 # Upload & Download helpers
 # -------------------------------------------------------------------
+def local_md5(local_path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Hex MD5 of *local_path*, read in 1 MiB blocks – comparable with
+    Drive's ``md5Checksum`` metadata.
+    """
+    digest = hashlib.md5()
+    with open(local_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def upload_file(local_path: str, folder_id: str, overwrite: bool = True) -> str:
     """
     Upload *local_path* to Drive under *folder_id*.
     If a file with the same name already exists and *overwrite* is True,
-    it will be updated.
+    it will be updated (skipped when its md5 already matches).
     Returns the Drive file ID.
     """
     _, _, MediaFileUpload, _ = _google_deps()
@@ -187,29 +289,52 @@ def upload_file(local_path: str, folder_id: str, overwrite: bool = True) -> str:
     file_name = os.path.basename(local_path)
     mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
 
-    # Check for an existing file first
-    existing = find_file_by_name(file_name, folder_id)
-    media_body = MediaFileUpload(local_path, mimetype=mime_type, resumable=True)
-
-    if existing and overwrite:
+    # Check for an existing file first. Its md5 is always fetched fresh:
+    # someone else may have changed the file since this process last saw it.
+    existing_id = _find_id(file_name, folder_id) if overwrite else None
+    if existing_id:
+        from googleapiclient.errors import HttpError
+
+        try:
+            remote = svc.files().get(
+                fileId=existing_id, fields="md5Checksum", supportsAllDrives=True
+            ).execute()
+        except HttpError as err:
+            if err.resp.status != 404:
+                raise
+            # Deleted since we cached its id: forget it and create a new file.
+            with _file_ids_lock:
+                _file_ids.pop((file_name, folder_id), None)
+            existing_id = None
+        else:
+            if remote.get("md5Checksum") == local_md5(local_path):
+                # Drive already holds these exact bytes.
+                return existing_id
+
+    resumable = os.path.getsize(local_path) > RESUMABLE_MIN_SIZE
+    media_body = MediaFileUpload(local_path, mimetype=mime_type, resumable=resumable, chunksize=CHUNK_SIZE)
+
+    if existing_id:
         svc.files().update(
-            fileId=existing["id"],
+            fileId=existing_id,
             media_body=media_body,
             supportsAllDrives=True,
-        ).execute()
-        return existing["id"]
+        ).execute(num_retries=NUM_RETRIES)
+        return existing_id
 
     # Create a new file
     meta = {"name": file_name, "parents": [folder_id]}
     created = svc.files().create(
         body=meta, media_body=media_body, fields="id", supportsAllDrives=True
-    ).execute()
+    ).execute(num_retries=NUM_RETRIES)
+    with _file_ids_lock:
+        _file_ids[(file_name, folder_id)] = created["id"]
     return created["id"]
 
 
 def download_file(file_id: str, local_path: str) -> str:
     """
-    Download a Drive file into *local_path*.
+    Download a Drive file into *local_path*, streaming it to disk chunk by chunk.
     Returns the path that was written.
     """
     svc = _service()
@@ -217,13 +342,10 @@ def download_file(file_id: str, local_path: str) -> str:
 
     request = svc.files().get_media(fileId=file_id, supportsAllDrives=True)
 
-    with io.BytesIO() as file_buffer:
-        downloader = MediaIoBaseDownload(file_buffer, request)
+    with io.FileIO(local_path, "wb") as fh:
+        downloader = MediaIoBaseDownload(fh, request, chunksize=CHUNK_SIZE)
         done = False
         while not done:
-            _, done = downloader.next_chunk()
-
-        with open(local_path, "wb") as fh:
-            fh.write(file_buffer.getvalue())
+            _, done = downloader.next_chunk(num_retries=NUM_RETRIES)
 
     return local_path
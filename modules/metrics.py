@@ -0,0 +1,45 @@
+"""Array kernels for the bulk paths (Excel import, reports).
+
+numba is optional: when it is installed, large batches run through a
+JIT-compiled parallel loop; otherwise (and for small batches, where JIT and
+thread start-up cost more than they save) the same math runs as NumPy
+expressions.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # pragma: no cover - numba is an optional speed-up
+    njit = None
+
+# Below this many rows the NumPy path is already sub-millisecond.
+NUMBA_MIN_ROWS = 100_000
+
+
+def _profit_numpy(cost, tax, other, price):
+    total = cost + tax + other
+    profit = price - total
+    margin = np.divide(profit, price, out=np.zeros_like(profit), where=price != 0)
+    return total, profit, margin
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _profit_kernel(cost, tax, other, price, out_tc, out_ep, out_pm):
+        for i in prange(cost.shape[0]):
+            tc = cost[i] + tax[i] + other[i]
+            ep = price[i] - tc
+            out_tc[i] = tc
+            out_ep[i] = ep
+            out_pm[i] = ep / price[i] if price[i] != 0 else 0.0
+
+
+def profit_metrics(cost, tax, other, price):
+    """Return unrounded (total_cost, est_profit, profit_margin) float64 arrays."""
+    cost, tax, other, price = (np.ascontiguousarray(a, dtype=np.float64) for a in (cost, tax, other, price))
+    n = cost.shape[0]
+    if njit is None or n < NUMBA_MIN_ROWS:
+        return _profit_numpy(cost, tax, other, price)
+    out_tc, out_ep, out_pm = np.empty(n), np.empty(n), np.empty(n)
+    _profit_kernel(cost, tax, other, price, out_tc, out_ep, out_pm)
+    return out_tc, out_ep, out_pm
@@ -1,7 +1,9 @@
 # modules/sync.py
 import os, time, stat, shutil, pathlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
 from . import gdrive  # your existing Drive helper module
+from . import db
 
 def _cleanup_sqlite_sidecars(db_path: str):
     for suf in ("-journal", "-wal", "-shm"):
@@ -21,7 +23,12 @@ def _ensure_writable(path: str):
     except PermissionError:
         pass
 
-def _safe_replace(src: str, dst: str, retries: int = 8, base_delay: float = 0.25):
+# Callers swap inside db.swapping(), so the app holds no handle on dst and
+# opens none meanwhile: POSIX swaps in one go; Windows keeps one short retry
+# for AV scanners (or a reader still finishing its last query).
+_REPLACE_RETRIES = 2 if os.name == "nt" else 1
+
+def _safe_replace(src: str, dst: str, retries: int = _REPLACE_RETRIES, base_delay: float = 0.05):
     # Extra guard: fail fast with a helpful message if src is missing
     if not os.path.exists(src):
         raise FileNotFoundError(
@@ -38,9 +45,13 @@ def _safe_replace(src: str, dst: str, retries: int = 8, base_delay: float = 0.25
             return
         except PermissionError as e:
             last_err = e
-            time.sleep(base_delay * (2 ** attempt))
+            if attempt + 1 < retries:
+                time.sleep(base_delay * (2 ** attempt))
+
+    if os.name != "nt":
+        raise last_err
 
-    # Shadow-copy fallback
+    # Shadow-copy fallback (Windows: a scanner may still hold dst open)
     tmp_shadow = dst + ".shadow_copy"
     try:
         _cleanup_sqlite_sidecars(dst)
@@ -52,24 +63,20 @@ def _safe_replace(src: str, dst: str, retries: int = 8, base_delay: float = 0.25
     except Exception as e:
         raise last_err or e
 
-def _local_mtime(path: str) -> float:
-    try:
-        return os.path.getmtime(path)
-    except FileNotFoundError:
-        return 0.0
-
 def _pick_remote_db(files: list, expected_name: Optional[str]) -> Optional[dict]:
-    # Only consider .db files
-    dbs = [f for f in files if str(f.get("name","")).lower().endswith(".db")]
-    if not dbs:
-        return None
-    # Prefer exact filename match (same as local)
-    if expected_name:
-        for f in dbs:
-            if f.get("name") == expected_name:
-                return f
-    # Else pick the newest by modifiedTimeEpoch (caller must populate this in list_files)
-    return max(dbs, key=lambda f: float(f.get("modifiedTimeEpoch", 0) or 0))
+    # One pass over the .db files: an exact filename match (same as local)
+    # wins outright, else the newest by modifiedTimeEpoch (set by gdrive's listings).
+    best, best_t = None, -1.0
+    for f in files:
+        name = str(f.get("name", ""))
+        if not name.lower().endswith(".db"):
+            continue
+        if expected_name and name == expected_name:
+            return f
+        t = float(f.get("modifiedTimeEpoch") or 0)
+        if t > best_t:
+            best, best_t = f, t
+    return best
 
 def newest_wins_sync(local_db: str, folder_id: str) -> Dict[str, str]:
     """
@@ -79,23 +86,41 @@ def newest_wins_sync(local_db: str, folder_id: str) -> Dict[str, str]:
     tmp_dir = os.path.dirname(dst) or "."
     pathlib.Path(tmp_dir).mkdir(parents=True, exist_ok=True)
 
-    # 1) enumerate remote
-    files = gdrive.list_files(folder_id)
-    remote = _pick_remote_db(files, expected_name=os.path.basename(dst))
+    # One stat for existence, mtime and size of the local DB.
+    try:
+        st = os.stat(dst)
+        local_exists, local_epoch, local_size = True, st.st_mtime, st.st_size
+    except FileNotFoundError:
+        local_exists, local_epoch, local_size = False, 0.0, 0
+
+    # 1) find the remote DB, hashing the local DB on a worker thread meanwhile:
+    #    the two are independent, so the sync waits for the slower one only.
+    #    An exact-name lookup is one small request; only when it misses is the
+    #    whole folder listed for the newest .db.
+    expected_name = os.path.basename(dst)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        local_hash = pool.submit(gdrive.local_md5, dst) if local_exists else None
+        remote = gdrive.find_file_by_name(expected_name, folder_id)
+        if remote is None:
+            remote = _pick_remote_db(gdrive.list_files(folder_id), expected_name)
+        local_md5 = local_hash.result() if local_hash else None
 
     if not remote:
-        if os.path.exists(dst):
+        if local_exists:
             gdrive.upload_file(dst, folder_id)
             return {"status": "ok", "action": "upload", "why": "remote missing; uploaded local", "path": dst}
         return {"status": "ok", "action": "noop", "why": "no local or remote DB", "path": dst}
 
-    # 2) compare times/sizes
+    # 2) identical content: nothing to move, whatever the clocks say
+    remote_md5 = remote.get("md5Checksum")
+    if remote_md5 and local_md5 == remote_md5:
+        return {"status": "ok", "action": "noop", "why": "same content (md5)", "path": dst}
+
+    # 3) fall back to comparing times/sizes
     remote_epoch = float(remote.get("modifiedTimeEpoch", 0) or 0)
-    local_epoch = _local_mtime(dst)
     remote_size = int(remote.get("size", 0) or 0)
-    local_size = int(os.path.getsize(dst)) if os.path.exists(dst) else 0
 
-    # 3) decide direction
+    # 4) decide direction
     if (remote_epoch > local_epoch) or (remote_epoch == 0 and remote_size > 0 and remote_size != local_size):
         # Remote -> Local
         tmp_path = os.path.join(tmp_dir, "takeout.db.download.tmp")
@@ -121,8 +146,15 @@ def newest_wins_sync(local_db: str, folder_id: str) -> Dict[str, str]:
                 pass
             raise IOError("Downloaded temp file is empty; aborting replace.")
 
+        if local_md5 and gdrive.local_md5(tmp_path) == local_md5:
+            os.remove(tmp_path)
+            return {"status": "ok", "action": "noop", "why": "downloaded copy identical to local", "path": dst}
+
         try:
-            _safe_replace(tmp_path, dst)
+            # Release the app's connections (and keep readers off) so the swap
+            # isn't blocked and no stale WAL gets replayed onto the new file.
+            with db.swapping():
+                _safe_replace(tmp_path, dst)
         finally:
             # best-effort cleanup if temp still remains
             if os.path.exists(tmp_path):
@@ -131,6 +163,8 @@ def newest_wins_sync(local_db: str, folder_id: str) -> Dict[str, str]:
                 except Exception:
                     pass
 
+        # Fresh file from elsewhere: bring its planner stats up to date once.
+        db.optimize()
         return {"status": "ok", "action": "download", "why": "remote newer", "path": dst}
 
     if local_epoch > remote_epoch or (remote_epoch == 0 and local_size > 0 and local_size != remote_size):
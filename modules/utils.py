@@ -1,20 +1,24 @@
+import re
 from datetime import datetime
+import numpy as np
+from .metrics import profit_metrics
 VAT_RATE_DEFAULT = 0.12
+# Y-M-D with one separator used consistently ('-', '/' or '.').
+_DATE_RE = re.compile(r"^\s*(\d{1,4})([-/.])(\d{1,2})\2(\d{1,2})\s*$")
 def ymd(date_like):
     if isinstance(date_like, str):
-        for sep in ('-','/','.'):
-            if sep in date_like:
-                parts = date_like.split(sep)
-                if len(parts)==3:
-                    y,m,d = parts
-                    return f"{int(y):04d}-{int(m):02d}-{int(d):02d}"
-        return date_like
+        m = _DATE_RE.match(date_like)
+        return f"{int(m[1]):04d}-{int(m[3]):02d}-{int(m[4]):02d}" if m else date_like
     return date_like.strftime('%Y-%m-%d')
 def compute_profit_metrics(item_cost, tax_amount, other_costs, selling_price):
     total_cost = float(item_cost or 0)+float(tax_amount or 0)+float(other_costs or 0)
     est_profit = float(selling_price or 0)-total_cost
     margin = est_profit/float(selling_price) if selling_price else 0.0
     return {'total_cost': round(total_cost,2), 'est_profit': round(est_profit,2), 'profit_margin': round(margin,4)}
+def compute_profit_metrics_vec(item_cost, tax_amount, other_costs, selling_price):
+    """Array version of compute_profit_metrics; returns (total_cost, est_profit, profit_margin)."""
+    total_cost, est_profit, margin = profit_metrics(item_cost, tax_amount, other_costs, selling_price)
+    return np.round(total_cost,2), np.round(est_profit,2), np.round(margin,4)
 def compute_vat(vat_inclusive: bool, amount: float, vat_rate: float = VAT_RATE_DEFAULT):
     amount = float(amount or 0)
     if vat_inclusive: